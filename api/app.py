@@ -1,17 +1,74 @@
-from nutrient_analyzer import analyze_nutrients
-from rda import find_nutrition
+from nutrient_analyzer import analyze_nutrients, analyze_nutrients_bulk
+from rda import find_nutrition, rda_result, process_nutrition_data_bulk
+from scoring import process_nutrition_bulk
+from profiles import (DEFAULT_PROFILE, profile_index, profile_versions, profile_positions, daily_value_rows, threshold_rows,
+                      list_profiles)
+from nutrient_extractor import (extract_nutrition_per_serving, nutrient_name_list, resolve_label, resolve_labels,
+                                label_matching_version, SEMANTIC_LABEL_MATCHING)
+from cache import canonical_hash, create_cache_from_env
+from llm_client import create_chat_completion, stream_chat_completion, close_client
+from singleflight import SingleFlight
+from product_store import fetch_product, fetch_products, close_client as close_product_store, PRECOMPUTED_FIELD
+from metrics import timed, render_metrics, precomputed_lookups
+from prompts import (EXTRACTION_PROMPT_VERSION, ICMR_PROMPT_VERSION, NUTRITION_RESPONSE_FORMAT, build_extraction_messages,
+                     build_icmr_messages, check_prompt_budget)
 import os
 import json
-from fastapi import FastAPI, HTTPException
+import asyncio
+import logging
+import zipfile
+import tempfile
+import importlib.util
+from datetime import datetime, timezone
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Body, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List, Dict, Any
-from openai import OpenAI
+from fastapi.responses import StreamingResponse, PlainTextResponse, FileResponse
+from starlette.background import BackgroundTask
+from typing import List, Dict, Any, Optional, Annotated, Literal
 
-app = FastAPI(title="Nutrition Analysis API
 
-debug_mode = True
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY")
-                
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if SEMANTIC_LABEL_MATCHING:
+        # Warm up the label matcher in the background; requests don't wait for it unless they need it
+        from label_matcher import start_loading
+        start_loading()
+    yield
+    # Release the pooled LLM and MongoDB connections
+    await close_client()
+    close_product_store()
+
+
+app = FastAPI(title="Nutrition Analysis API", lifespan=lifespan)
+
+# Debug logging (prompts, intermediate results) is off unless NUTRIENT_DEBUG is set
+debug_mode = os.getenv("NUTRIENT_DEBUG", "").lower() in ("1", "true", "yes")
+logging.basicConfig(level=logging.DEBUG if debug_mode else logging.INFO,
+                    format="%(asctime)s %(levelname)s %(name)s %(message)s")
+logger = logging.getLogger("nutrient_analysis")
+
+LLM_MODEL = "gpt-4o"
+# Label resolutions of another matcher (model, threshold, or rules only) must not be served from the caches
+LABEL_MATCHING_VERSION = label_matching_version()
+# Bump this whenever the shape of the precomputed analysis / %RDA changes so that old documents are recomputed
+PRECOMPUTED_VERSION = "2"
+
+result_cache = create_cache_from_env()
+# Concurrent requests for the same product share one in-flight extraction / analysis
+extraction_flights = SingleFlight("extraction")
+analysis_flights = SingleFlight("analysis")
+
+# How often to check whether the client of a running analysis has disconnected (seconds)
+DISCONNECT_POLL_INTERVAL = float(os.getenv("DISCONNECT_POLL_INTERVAL", 0.5))
+# Default number of concurrent LLM calls per batch request
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 8))
+
+CORRUPT_PRODUCT_MESSAGE = "product not found because product information in the db is corrupt"
+
+# How often rda_analysis could map the label locally vs. had to fall back to the LLM
+extraction_stats = {'requests': 0, 'rules': 0, 'llm_fallback': 0}
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -21,6 +78,22 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+async def run_until_disconnected(request: Request, coroutine):
+    """Await coroutine, cancelling it (and its in-flight LLM calls) if the HTTP client disconnects."""
+    task = asyncio.ensure_future(coroutine)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                logger.info("client_disconnected action=cancel_analysis")
+                task.cancel()
+                raise HTTPException(status_code=499, detail="Client closed request")
+    finally:
+        task.cancel()
+
+
 def find_product_nutrients(product_info_from_db):
     #GET Response: {'_id': '6714f0487a0e96d7aae2e839',
     #'brandName': 'Parle', 'claims': ['This product does not contain gold'],
@@ -70,10 +143,17 @@ def find_product_nutrients(product_info_from_db):
                 salt = 0
             salt += item['values'][0]['value']
 
+    # Labels like "Calories" or "Na" don't pass the substring checks, resolve them by their meaning
+    if calories is None:
+        for item in product_info_from_db["nutritionalInformation"]:
+            if resolve_label(item['name']) == 'energy':
+                calories = item['values'][0]['value']
+                break
+
     if salt is None:
         salt = 0
         for item in product_info_from_db["nutritionalInformation"]:
-            if 'sodium' in item['name'].lower():
+            if 'sodium' in item['name'].lower() or resolve_label(item['name']) == 'sodium':
                 salt += item['values'][0]['value']
 
     if added_sugar is not None and added_sugar > 0 and sugar is None:
@@ -85,62 +165,47 @@ def find_product_nutrients(product_info_from_db):
 
 
 async def rda_analysis(product_info_from_db_nutritionalInformation: Dict[str, Any], 
-                product_info_from_db_servingSize: float) -> Dict[str, Any]:
+                product_info_from_db_servingSize: float,
+                llm_semaphore: asyncio.Semaphore = None) -> Dict[str, Any]:
     """
     Analyze nutritional information and return RDA analysis data in a structured format.
     
     Args:
         product_info_from_db_nutritionalInformation: Dictionary containing nutritional information
         product_info_from_db_servingSize: Serving size value
+        llm_semaphore: Optional semaphore bounding concurrent LLM calls
         
     Returns:
-        Dictionary containing nutrition per serving and user serving size
+        Dictionary containing nutrition per serving, user serving size and whether the
+        values came from the rule-based extractor ('rules') or the LLM ('llm')
     """
-    nutrient_name_list = [
-        'energy', 'protein', 'carbohydrates', 'addedSugars', 'dietaryFiber',
-        'totalFat', 'saturatedFat', 'monounsaturatedFat', 'polyunsaturatedFat',
-        'transFat', 'sodium'
-    ]
+    extraction_stats['requests'] += 1
+
+    # Structured labels are resolved locally, the LLM is only needed for labels the rules can't map
+    # (resolve_labels runs first, see cached_rda_analysis)
+    nutrition_data, unresolved = extract_nutrition_per_serving(product_info_from_db_nutritionalInformation,
+                                                               product_info_from_db_servingSize)
+    if nutrition_data is not None:
+        extraction_stats['rules'] += 1
+        return {
+            'nutritionPerServing': nutrition_data,
+            'userServingSize': product_info_from_db_servingSize,
+            'extractionSource': 'rules'
+        }
+
+    extraction_stats['llm_fallback'] += 1
+    logger.info("llm_extraction_fallback fallbacks=%d requests=%d unresolved=%s",
+                extraction_stats['llm_fallback'], extraction_stats['requests'], unresolved)
 
     try:
-        response = await client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "system",
-                    "content": """You will be given nutritional information of a food product. 
-                                Return the data in the exact JSON format specified in the schema, 
-                                with all required fields."""
-                },
-                {
-                    "role": "user",
-                    "content": f"Nutritional content of food product is {json.dumps(product_info_from_db_nutritionalInformation)}. "
-                              f"Extract the values of the following nutrients: {', '.join(nutrient_name_list)}."
-                }
-            ],
-        response_format={"type": "json_schema", "json_schema": {
-            "name": "Nutritional_Info_Label_Reader",
-            "schema": {
-                "type": "object",
-                "properties": {
-                    "energy": {"type": "number"},
-                    "protein": {"type": "number"},
-                    "carbohydrates": {"type": "number"},
-                    "addedSugars": {"type": "number"},
-                    "dietaryFiber": {"type": "number"},
-                    "totalFat": {"type": "number"},
-                    "saturatedFat": {"type": "number"},
-                    "monounsaturatedFat": {"type": "number"},
-                    "polyunsaturatedFat": {"type": "number"},
-                    "transFat": {"type": "number"},
-                    "sodium": {"type": "number"},
-                    "servingSize": {"type": "number"},
-                },
-                "required": nutrient_name_list + ["servingSize"],
-                "additionalProperties": False
-            },
-            "strict": True
-        }}
+        messages = build_extraction_messages(product_info_from_db_nutritionalInformation)
+        check_prompt_budget("rda_analysis", messages)
+        response = await create_chat_completion(
+            llm_semaphore,
+            call="rda_analysis",
+            model=LLM_MODEL,
+            messages=messages,
+            response_format=NUTRITION_RESPONSE_FORMAT
         )
         
         # Parse the JSON response
@@ -150,7 +215,7 @@ async def rda_analysis(product_info_from_db_nutritionalInformation: Dict[str, An
         missing_fields = [field for field in nutrient_name_list + ["servingSize"] 
                          if field not in nutrition_data]
         if missing_fields:
-            print(f"Missing required fields in API response: {missing_fields}")
+            logger.warning("rda_analysis_missing_fields fields=%s", missing_fields)
         
         # Validate that all values are numbers
         non_numeric_fields = [field for field, value in nutrition_data.items() 
@@ -160,92 +225,614 @@ async def rda_analysis(product_info_from_db_nutritionalInformation: Dict[str, An
         
         return {
             'nutritionPerServing': nutrition_data,
-            'userServingSize': product_info_from_db_servingSize
+            'userServingSize': product_info_from_db_servingSize,
+            'extractionSource': 'llm'
         }
         
     except Exception as e:
         # Log the error and raise it for proper handling
-        print(f"Error in RDA analysis: {str(e)}")
+        logger.error("rda_analysis_error error=%s", e)
         raise
 
 
-async def analyze_nutrition_icmr_rda(nutrient_analysis, nutrient_analysis_rda):
-    global debug_mode, client
-    system_prompt = """
-Task: Analyze the nutritional content of the food item and compare it to the Recommended Daily Allowance (RDA) or threshold limits defined by ICMR. Provide practical, contextual insights based on the following nutrients:
+# Results computed while the semantic label matcher was loading or unavailable (resolve_labels returned
+# False) are resolved with the rules only; they are served, but never cached or precomputed under keys
+# that claim semantic matching (LABEL_MATCHING_VERSION).
+
+def extraction_cache_key(nutritional_information, serving_size):
+    return canonical_hash('extraction', EXTRACTION_PROMPT_VERSION, LLM_MODEL, LABEL_MATCHING_VERSION,
+                          nutritional_information, serving_size)
+
+
+def analysis_cache_key(product_info_from_db, profile_id=DEFAULT_PROFILE):
+    # Only the fields the pipeline reads; servingSize includes the unit, which decides solid vs liquid
+    parts = ['analysis', ICMR_PROMPT_VERSION, LLM_MODEL, LABEL_MATCHING_VERSION,
+             product_info_from_db['nutritionalInformation'], product_info_from_db['servingSize']]
+    if profile_id != DEFAULT_PROFILE:
+        # Keys of the default profile stay as they were; other profiles are keyed by their values
+        parts.append(profile_versions[profile_id])
+    return canonical_hash(*parts)
+
 
-Nutrient Breakdown and Analysis:
-Calories:
+def precompute_source_hash(product_info_from_db):
+    # Everything the threshold analysis and %RDA depend on; the narrative also depends on the ICMR prompt (analysis_cache_key)
+    return canonical_hash('precomputed', PRECOMPUTED_VERSION, EXTRACTION_PROMPT_VERSION, LLM_MODEL, LABEL_MATCHING_VERSION,
+                          product_info_from_db['nutritionalInformation'], product_info_from_db['servingSize'])
 
-Compare the calorie content to a well-balanced meal.
-Calculate how many meals' worth of calories the product contains, providing context for balanced eating.
-Sugar & Salt:
 
-Convert the amounts of sugar and salt into teaspoons to help users easily understand their daily intake.
-Explain whether the levels exceed the ICMR-defined limits and what that means for overall health.
-Fat & Calories:
+def fresh_precomputed(product_info_from_db):
+    """The materialized analysis of a product document (see precompute.py), if it matches the document's current nutrition data."""
+    precomputed = product_info_from_db.get(PRECOMPUTED_FIELD)
+    if isinstance(precomputed, dict) and precomputed.get('sourceHash') == precompute_source_hash(product_info_from_db):
+        return precomputed
+    return None
 
-Analyze fat content, specifying whether it is high or low in relation to a balanced diet.
-Offer insights on how the fat and calorie levels may impact the user’s overall diet, including potential risks or benefits.
-Contextual Insights:
-For each nutrient, explain how its levels (whether high or low) affect health and diet balance.
-Provide actionable recommendations for the user, suggesting healthier alternatives or adjustments to consumption if necessary.
-Tailor the advice to the user's lifestyle, such as recommending lower intake if sedentary or suggesting other dietary considerations based on the product's composition.
 
-Output Structure:
-For each nutrient (Calories, Sugar, Salt, Fat), specify if the levels exceed or are below the RDA or ICMR threshold.
-Provide clear, concise comparisons (e.g., sugar exceeds the RDA by 20%, equivalent to X teaspoons).    
+def precomputed_narrative(precomputed, product_info_from_db):
+    # The narrative is only valid for the prompt version / model it was generated with
+    return precomputed.get('narrativeKey') == analysis_cache_key(product_info_from_db)
+
+
+async def compute_precomputed(product_info_from_db, narrative=False, llm_semaphore=None):
     """
+    Materialized analysis of a product document: threshold analysis, %RDA and, if narrative is set,
+    the ICMR narrative. 'analysis' is None if the product information is corrupt.
+    None if the labels could not be resolved because the semantic label matcher is unavailable.
+    """
+    if not await resolve_labels(product_info_from_db['nutritionalInformation']):
+        return None
+    precomputed = {
+        'sourceHash': precompute_source_hash(product_info_from_db),
+        'analysis': None,
+        'rda': None,
+        'narrative': None,
+        'narrativeKey': None,
+        'computedAt': datetime.now(timezone.utc),
+    }
+    prepared = await prepare_nutrient_analysis(product_info_from_db, llm_semaphore)
+    if prepared is None:
+        # Nothing to narrate either, a corrupt product is answered without calling the LLM
+        precomputed['narrativeKey'] = analysis_cache_key(product_info_from_db)
+        return precomputed
+    precomputed['analysis'], precomputed['rda'] = prepared
 
-    user_prompt = f"""
-Nutrition Analysis :
-{nutrient_analysis}
-{nutrient_analysis_rda}
-"""
-    if debug_mode:
-        print(f"\nuser_prompt : \n {user_prompt}")
-        
-    completion = await client.chat.completions.create(
-        model="gpt-4o",  # Make sure to use an appropriate model
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ]
+    if narrative:
+        precomputed['narrative'] = await run_nutrient_analysis(product_info_from_db, llm_semaphore)
+        precomputed['narrativeKey'] = analysis_cache_key(product_info_from_db)
+    return precomputed
+
+
+async def cached_rda_analysis(nutritional_information, serving_size, llm_semaphore=None):
+    # Cached separately from the final result so that a change of the ICMR prompt keeps the extractions
+    cache_key = extraction_cache_key(nutritional_information, serving_size)
+    nutrient_analysis_rda_data = await result_cache.get(cache_key)
+    if nutrient_analysis_rda_data is not None:
+        return nutrient_analysis_rda_data
+
+    async def extract():
+        labels_resolved = await resolve_labels(nutritional_information)
+        nutrient_analysis_rda_data = await rda_analysis(nutritional_information, serving_size, llm_semaphore)
+        if labels_resolved:
+            await result_cache.set(cache_key, nutrient_analysis_rda_data)
+        return nutrient_analysis_rda_data
+
+    return await extraction_flights.do(cache_key, extract)
+
+
+def icmr_messages(nutrient_analysis, nutrient_analysis_rda):
+    messages = build_icmr_messages(nutrient_analysis, nutrient_analysis_rda)
+    logger.debug("icmr_user_prompt prompt=%r", messages[-1]["content"])
+    check_prompt_budget("analyze_nutrition_icmr_rda", messages)
+    return messages
+
+
+async def analyze_nutrition_icmr_rda(nutrient_analysis, nutrient_analysis_rda, llm_semaphore=None):
+    completion = await create_chat_completion(
+        llm_semaphore,
+        call="analyze_nutrition_icmr_rda",
+        model=LLM_MODEL,  # Make sure to use an appropriate model
+        messages=icmr_messages(nutrient_analysis, nutrient_analysis_rda)
     )
 
     return completion.choices[0].message.content
 
+
+async def stream_nutrition_icmr_rda(nutrient_analysis, nutrient_analysis_rda):
+    """Same as analyze_nutrition_icmr_rda, but yields the narrative piece by piece as gpt-4o generates it."""
+    async for text in stream_chat_completion(
+        call="analyze_nutrition_icmr_rda",
+        model=LLM_MODEL,
+        messages=icmr_messages(nutrient_analysis, nutrient_analysis_rda)
+    ):
+        yield text
+
+
+async def threshold_analysis(product_info_from_db, profile_id=DEFAULT_PROFILE):
+    """Returns (nutrient_analysis, serving_size), or None if the product information is corrupt."""
+    await resolve_labels(product_info_from_db['nutritionalInformation'])
+    with timed("find_product_nutrients"):
+        product_type, calories, sugar, salt, serving_size = find_product_nutrients(product_info_from_db)
+    if product_type is None or serving_size is None or serving_size <= 0:
+        return None
+
+    with timed("analyze_nutrients"):
+        nutrient_analysis = await analyze_nutrients(product_type, calories, sugar, salt, serving_size,
+                                                    threshold_rows([profile_id], [product_type]))
+    logger.debug("nutrient_analysis result=%s", nutrient_analysis)
+    return nutrient_analysis, serving_size
+
+
+async def rda_percentages(nutritional_information, serving_size, llm_semaphore=None, profile_id=DEFAULT_PROFILE):
+    with timed("rda_analysis"):
+        nutrient_analysis_rda_data = await cached_rda_analysis(nutritional_information, serving_size, llm_semaphore)
+    logger.debug("rda_analysis result=%s", nutrient_analysis_rda_data)
+
+    with timed("find_nutrition"):
+        nutrient_analysis_rda = await find_nutrition(nutrient_analysis_rda_data, daily_value_rows([profile_id])[0])
+    logger.debug("find_nutrition result=%s", nutrient_analysis_rda)
+    return nutrient_analysis_rda
+
+
+async def prepare_nutrient_analysis(product_info_from_db, llm_semaphore=None, profile_id=DEFAULT_PROFILE):
+    """
+    Threshold analysis and %RDA of a product. Only the extraction may need the LLM.
+    Returns (nutrient_analysis, nutrient_analysis_rda), the results of analyze_nutrients and find_nutrition,
+    or None if the product information is corrupt.
+    """
+    # Analyses are only precomputed for the default profile
+    precomputed = fresh_precomputed(product_info_from_db) if profile_id == DEFAULT_PROFILE else None
+    if precomputed is not None:
+        if precomputed['analysis'] is None:
+            return None
+        return precomputed['analysis'], precomputed['rda']
+
+    analyzed = await threshold_analysis(product_info_from_db, profile_id)
+    if analyzed is None:
+        return None
+    nutrient_analysis, serving_size = analyzed
+
+    nutrient_analysis_rda = await rda_percentages(product_info_from_db['nutritionalInformation'], serving_size,
+                                                  llm_semaphore, profile_id)
+    return nutrient_analysis, nutrient_analysis_rda
+
+
+async def run_nutrient_analysis(product_info_from_db, llm_semaphore=None, profile_id=DEFAULT_PROFILE,
+                                prepare=prepare_nutrient_analysis, labels_resolved=None):
+    """
+    Full pipeline for one product document. Returns the ICMR narrative, or None if the product information is corrupt.
+    prepare computes (nutrient_analysis, nutrient_analysis_rda) on a cache miss, see nutrient_analysis_batch.
+    labels_resolved is the result of resolve_labels if the caller already ran it.
+    """
+    cache_key = analysis_cache_key(product_info_from_db, profile_id)
+    precomputed = fresh_precomputed(product_info_from_db) if profile_id == DEFAULT_PROFILE else None
+    if precomputed is not None and precomputed_narrative(precomputed, product_info_from_db):
+        precomputed_lookups.inc(result="hit")
+        return precomputed['narrative']
+    # Without a narrative the precomputed threshold analysis and %RDA are still used by prepare_nutrient_analysis
+    precomputed_lookups.inc(result="miss" if precomputed is None else "partial")
+
+    cached_result = await result_cache.get(cache_key)
+    if cached_result is not None:
+        return cached_result
+
+    async def analyze():
+        resolved = labels_resolved
+        if resolved is None:
+            # The precomputed analysis was made with the labels resolved
+            resolved = precomputed is not None or await resolve_labels(product_info_from_db['nutritionalInformation'])
+        prepared = await prepare(product_info_from_db, llm_semaphore, profile_id)
+        if prepared is None:
+            return None
+        nutrient_analysis, nutrient_analysis_rda = prepared
+
+        #Call GPT for nutrient analysis
+        with timed("analyze_nutrition_icmr_rda"):
+            nutritional_level = await analyze_nutrition_icmr_rda(nutrient_analysis, nutrient_analysis_rda, llm_semaphore)
+
+        if resolved:
+            await result_cache.set(cache_key, nutritional_level)
+        return nutritional_level
+
+    return await analysis_flights.do(cache_key, analyze)
+
+
+async def profile_nutrient_analysis(product_info_from_db, requested_profile_ids: List[str], llm_semaphore=None):
+    """
+    Threshold analysis and %RDA of one product for many profiles, in one vectorized pass (no narrative).
+    Returns one dict per profile, or None if the product information is corrupt.
+    """
+    await resolve_labels(product_info_from_db['nutritionalInformation'])
+    with timed("find_product_nutrients"):
+        product_type, calories, sugar, salt, serving_size = find_product_nutrients(product_info_from_db)
+    if product_type is None or serving_size is None or serving_size <= 0:
+        return None
+
+    with timed("analyze_nutrients_bulk"):
+        analyses = analyze_nutrients_bulk([product_type], [calories], [sugar], [salt], [serving_size],
+                                          threshold_rows(requested_profile_ids, [product_type]))
+
+    with timed("rda_analysis"):
+        nutrient_analysis_rda_data = await cached_rda_analysis(product_info_from_db['nutritionalInformation'], serving_size,
+                                                               llm_semaphore)
+    with timed("process_nutrition_data_bulk"):
+        nutrition = process_nutrition_data_bulk([nutrient_analysis_rda_data['nutritionPerServing']],
+                                                [float(nutrient_analysis_rda_data['userServingSize'])],
+                                                daily_value_rows(requested_profile_ids))
+
+    return [{'profileId': profile_id, 'analysis': analysis['analysis'], 'scaledNutrition': scaled_nutrition,
+             'percentageDailyValues': percentage_daily_values}
+            for profile_id, analysis, (scaled_nutrition, percentage_daily_values) in zip(requested_profile_ids, analyses, nutrition)]
+
+
+def check_numeric(name, value):
+    """Values that go into the bulk scoring arrays must be numbers; None is a missing value."""
+    if value is not None and (not isinstance(value, (int, float)) or isinstance(value, bool)):
+        raise ValueError(f"non-numeric {name}: {value!r}")
+
+
+def score_documents(products: List[Dict[str, Any]], profile_id: str = DEFAULT_PROFILE) -> List[Dict[str, Any]]:
+    """
+    Local scoring of many product documents with one call of each bulk scoring function, shared by
+    nutrient_analysis_batch (score_products) and the spreadsheets (spreadsheets.score_chunk).
+
+    Returns one dict per product:
+        nutrients: (product_type, calories, sugar, salt, serving_size) of find_product_nutrients, or None
+        analysis: threshold analysis, None if the serving unit or size is invalid
+        unresolved: why the rules couldn't resolve the label, which then has no scaled / percentages
+        scaled: per-serving values ordered by nutrient_name_list, NaN when missing
+        percentages: %RDA ordered by percentage_nutrients, NaN when missing
+        error: the exception of a malformed product, which is scored no further
+    """
+    scores = [{'nutrients': None, 'analysis': None, 'unresolved': [], 'scaled': None, 'percentages': None, 'error': None}
+              for _ in products]
+    threshold_index, threshold_inputs = [], []
+    rda_index, nutrition, serving_sizes = [], [], []
+
+    for index, product_info_from_db in enumerate(products):
+        score = scores[index]
+        try:
+            score['nutrients'] = find_product_nutrients(product_info_from_db)
+            product_type, calories, sugar, salt, serving_size = score['nutrients']
+            # A malformed value must fail its own product, not the bulk call of the whole batch
+            for name, value in (('servingSize', serving_size), ('energy', calories), ('sugar', sugar), ('salt', salt)):
+                check_numeric(name, value)
+            if product_type is None or serving_size is None or serving_size <= 0:
+                continue
+            nutrition_data, score['unresolved'] = extract_nutrition_per_serving(product_info_from_db['nutritionalInformation'],
+                                                                                serving_size)
+        except Exception as e:
+            score['error'] = e
+            continue
+        threshold_index.append(index)
+        threshold_inputs.append((product_type, calories, sugar, salt, serving_size))
+        if nutrition_data is not None:
+            rda_index.append(index)
+            nutrition.append(nutrition_data)
+            serving_sizes.append(float(serving_size))
+
+    if threshold_inputs:
+        with timed("analyze_nutrients_bulk"):
+            product_types_list = [inputs[0] for inputs in threshold_inputs]
+            analyses = analyze_nutrients_bulk(*map(list, zip(*threshold_inputs)), threshold_rows([profile_id], product_types_list))
+        for index, analysis in zip(threshold_index, analyses):
+            scores[index]['analysis'] = analysis
+
+    if nutrition:
+        with timed("process_nutrition_data_bulk"):
+            scaled, percentages = process_nutrition_bulk(nutrition, serving_sizes, daily_value_rows([profile_id])[0])
+        for index, scaled_row, percentage_row in zip(rda_index, scaled.tolist(), percentages.tolist()):
+            scores[index]['scaled'] = scaled_row
+            scores[index]['percentages'] = percentage_row
+    return scores
+
+
+def score_products(products: List[Dict[str, Any]], profile_id: str = DEFAULT_PROFILE) -> List[Any]:
+    """
+    Threshold analysis and %RDA of many product documents (score_documents), using the precomputed
+    analyses where they are fresh. Returns one entry per product: (nutrient_analysis, nutrient_analysis_rda,
+    serving_size), where nutrient_analysis_rda is None if the label needs the LLM extraction; None if the
+    product information is corrupt; or the exception it raised.
+    """
+    scored = [None] * len(products)
+    pending = []
+    for index, product_info_from_db in enumerate(products):
+        precomputed = fresh_precomputed(product_info_from_db) if profile_id == DEFAULT_PROFILE else None
+        if precomputed is None:
+            pending.append(index)
+        elif precomputed['analysis'] is not None:
+            scored[index] = (precomputed['analysis'], precomputed['rda'], None)
+
+    for index, score in zip(pending, score_documents([products[index] for index in pending], profile_id)):
+        if score['error'] is not None:
+            scored[index] = score['error']
+            continue
+        if score['analysis'] is None:
+            continue
+        nutrient_analysis_rda = None
+        if score['percentages'] is not None:
+            # Labels the rules resolved; the others are extracted by the LLM in nutrient_analysis_batch
+            extraction_stats['requests'] += 1
+            extraction_stats['rules'] += 1
+            nutrient_analysis_rda = rda_result(score['percentages'])
+        scored[index] = (score['analysis'], nutrient_analysis_rda, score['nutrients'][4])
+    return scored
+
+
+async def nutrient_analysis_batch(products: List[Dict[str, Any]], concurrency: int = BATCH_CONCURRENCY,
+                                  product_ids: List[str] = None, profile_id: str = DEFAULT_PROFILE):
+    """
+    Analyse many product documents, yielding one result per product as soon as it is ready.
+    The local scoring of the whole batch runs up front in bulk (score_products); only the LLM work
+    (extraction fallbacks and narratives) is fanned out, bounded by `concurrency`. Results may arrive
+    out of order, each one carries the index of its product.
+    If the products were looked up by id, product_ids gives the requested ids (None products were not found).
+    """
+    llm_semaphore = asyncio.Semaphore(max(1, concurrency))
+    valid = [isinstance(product, dict) and bool(product.get('nutritionalInformation')) for product in products]
+    valid_index = [index for index, is_valid in enumerate(valid) if is_valid]
+    # Labels of the whole batch go through the semantic matcher together
+    labels_resolved = await resolve_labels([item for index in valid_index if isinstance(products[index]['nutritionalInformation'], list)
+                          for item in products[index]['nutritionalInformation']])
+    scored = dict(zip(valid_index, score_products([products[index] for index in valid_index], profile_id)))
+
+    async def analyze_item(index, product_info_from_db):
+        if product_ids is not None:
+            product_id = str(product_ids[index])
+        else:
+            product_id = str(product_info_from_db.get("_id", "")) if isinstance(product_info_from_db, dict) else ""
+        try:
+            if product_info_from_db is None and product_ids is not None:
+                raise LookupError("product not found")
+            if not valid[index]:
+                raise ValueError("product has no nutritionalInformation")
+            if isinstance(scored[index], Exception):
+                raise scored[index]
+
+            async def prepare(product_info_from_db, llm_semaphore, profile_id):
+                if scored[index] is None:
+                    return None
+                nutrient_analysis, nutrient_analysis_rda, serving_size = scored[index]
+                if nutrient_analysis_rda is None:
+                    nutrient_analysis_rda = await rda_percentages(product_info_from_db['nutritionalInformation'], serving_size,
+                                                                  llm_semaphore, profile_id)
+                return nutrient_analysis, nutrient_analysis_rda
+
+            nutritional_level = await run_nutrient_analysis(product_info_from_db, llm_semaphore, profile_id, prepare,
+                                                            labels_resolved)
+            if nutritional_level is None:
+                raise ValueError(CORRUPT_PRODUCT_MESSAGE)
+            return {"index": index, "_id": product_id, "result": nutritional_level}
+        except Exception as e:
+            logger.error("batch_item_error index=%d product_id=%s error=%s", index, product_id, e)
+            return {"index": index, "_id": product_id, "error": str(e)}
+
+    tasks = [asyncio.create_task(analyze_item(index, product)) for index, product in enumerate(products)]
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            yield await next_result
+    finally:
+        # The consumer went away (e.g. client disconnected), don't keep spending on LLM calls
+        for task in tasks:
+            task.cancel()
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream_nutrient_analysis(product_info_from_db, profile_id=DEFAULT_PROFILE):
+    """
+    Server-Sent Events for one product: 'analysis' (threshold analysis) and 'rda' (%RDA) as soon as
+    they are computed, then the ICMR narrative as 'token' events, then 'done' (or 'error').
+    """
+    try:
+        cache_key = analysis_cache_key(product_info_from_db, profile_id)
+        nutritional_level = None
+        labels_resolved = True
+        precomputed = fresh_precomputed(product_info_from_db) if profile_id == DEFAULT_PROFILE else None
+        if precomputed is not None:
+            if precomputed['analysis'] is None:
+                yield sse_event("error", {"detail": CORRUPT_PRODUCT_MESSAGE})
+                return
+            nutrient_analysis, nutrient_analysis_rda = precomputed['analysis'], precomputed['rda']
+            yield sse_event("analysis", nutrient_analysis)
+            yield sse_event("rda", nutrient_analysis_rda)
+            if precomputed_narrative(precomputed, product_info_from_db):
+                nutritional_level = precomputed['narrative']
+        else:
+            labels_resolved = await resolve_labels(product_info_from_db['nutritionalInformation'])
+            analyzed = await threshold_analysis(product_info_from_db, profile_id)
+            if analyzed is None:
+                yield sse_event("error", {"detail": CORRUPT_PRODUCT_MESSAGE})
+                return
+            nutrient_analysis, serving_size = analyzed
+            yield sse_event("analysis", nutrient_analysis)
+
+            nutrient_analysis_rda = await rda_percentages(product_info_from_db['nutritionalInformation'], serving_size,
+                                                          profile_id=profile_id)
+            yield sse_event("rda", nutrient_analysis_rda)
+
+        if nutritional_level is None:
+            nutritional_level = await result_cache.get(cache_key)
+        if nutritional_level is not None:
+            yield sse_event("token", {"text": nutritional_level})
+        else:
+            parts = []
+            # Includes the time the client takes to consume the stream
+            with timed("analyze_nutrition_icmr_rda_stream"):
+                async for text in stream_nutrition_icmr_rda(nutrient_analysis, nutrient_analysis_rda):
+                    parts.append(text)
+                    yield sse_event("token", {"text": text})
+            nutritional_level = "".join(parts)
+            if labels_resolved:
+                await result_cache.set(cache_key, nutritional_level)
+        yield sse_event("done", {})
+    except Exception as e:
+        logger.error("stream_error error=%s", e)
+        yield sse_event("error", {"detail": str(e)})
+
+
 @app.get("/api/nutrient-analysis")
-async def nutrient_analysis(product_info_from_db):
+async def nutrient_analysis(product_info_from_db=None, request: Request = None, stream: bool = False,
+                            product_id: Optional[str] = None, product_ids: Annotated[Optional[List[str]], Query()] = None,
+                            concurrency: int = BATCH_CONCURRENCY, profile_id: str = DEFAULT_PROFILE):
+    # RDA / threshold profile of the user (see profiles.py), checked before any work starts
+    profile_positions([profile_id])
+
+    # Products can be looked up by id instead of being sent in full
+    if product_ids:
+        found_products = await fetch_products(product_ids)
+
+        async def stream_results():
+            async for item in nutrient_analysis_batch(found_products, concurrency, product_ids, profile_id):
+                yield json.dumps(item) + "\n"
+
+        return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+    if product_id is not None:
+        product_info_from_db = await fetch_product(product_id)
+        if product_info_from_db is None:
+            raise HTTPException(status_code=404, detail=f"Product {product_id} not found")
+
     if product_info_from_db:
-      brand_name = product_info_from_db.get("brandName", "")
-      product_name = product_info_from_db.get("productName", "")
-      ingredients_list = [ingredient["name"] for ingredient in product_info_from_db.get("ingredients", [])]
-      claims_list = product_info_from_db.get("claims", [])
       nutritional_information = product_info_from_db['nutritionalInformation']
-      serving_size = product_info_from_db["servingSize"]["quantity"]
-    
-      nutrient_analysis_rda = ""
-      nutrient_analysis = ""
-      nutritional_level = ""
-            
-      if nutritional_information:
-          product_type, calories, sugar, salt, serving_size = find_product_nutrients(product_info_from_db)
-          if product_type is not None and serving_size is not None and serving_size > 0:                                                          
-              nutrient_analysis = await analyze_nutrients(product_type, calories, sugar, salt, serving_size)                       
-          else:                                                                                                              
-              return "product not found because product information in the db is corrupt"   
-          print(f"DEBUG ! nutrient analysis is {nutrient_analysis}")
-    
-          nutrient_analysis_rda_data = await rda_analysis(nutritional_information, serving_size)
-          print(f"DEBUG ! Data for RDA nutrient analysis is of type {type(nutrient_analysis_rda_data)} - {nutrient_analysis_rda_data}")
-          print(f"DEBUG : nutrient_analysis_rda_data['nutritionPerServing'] : {nutrient_analysis_rda_data['nutritionPerServing']}")
-          print(f"DEBUG : nutrient_analysis_rda_data['userServingSize'] : {nutrient_analysis_rda_data['userServingSize']}")
-                
-          nutrient_analysis_rda = await find_nutrition(nutrient_analysis_rda_data)
-          print(f"DEBUG ! RDA nutrient analysis is {nutrient_analysis_rda}")
-                
-          #Call GPT for nutrient analysis
-          nutritional_level = await analyze_nutrition_icmr_rda(nutrient_analysis, nutrient_analysis_rda)
 
+      if nutritional_information:
+          if stream:
+              # Disconnects close the generator, which aborts the LLM stream
+              return StreamingResponse(stream_nutrient_analysis(product_info_from_db, profile_id), media_type="text/event-stream",
+                                       headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+          if request is not None:
+              nutritional_level = await run_until_disconnected(request, run_nutrient_analysis(product_info_from_db, profile_id=profile_id))
+          else:
+              nutritional_level = await run_nutrient_analysis(product_info_from_db, profile_id=profile_id)
+          if nutritional_level is None:
+              return CORRUPT_PRODUCT_MESSAGE
           return nutritional_level
+
+
+@app.post("/api/nutrient-analysis/batch")
+async def batch_nutrient_analysis(products: List[Dict[str, Any]] = Body(...), concurrency: int = BATCH_CONCURRENCY,
+                                  profile_id: str = DEFAULT_PROFILE):
+    profile_positions([profile_id])
+
+    # One JSON object per line, streamed as each product finishes
+    async def stream_results():
+        async for item in nutrient_analysis_batch(products, concurrency, profile_id=profile_id):
+            yield json.dumps(item) + "\n"
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+spreadsheet_media_types = {
+    'csv': "text/csv",
+    'xlsx': "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+
+def remove_when_done(rows, path):
+    try:
+        yield from rows
+    finally:
+        os.remove(path)
+
+
+def require_spreadsheet_formats(*file_formats):
+    # openpyxl is not installed in the serverless function (see requirements-worker.txt)
+    if 'xlsx' in file_formats and importlib.util.find_spec("openpyxl") is None:
+        raise HTTPException(status_code=501, detail="xlsx spreadsheets are not available on this deployment, use csv")
+
+
+async def spreadsheet_response(rows, file_format, filename):
+    # spreadsheets.py (and openpyxl) are only imported by the spreadsheet endpoints
+    from spreadsheets import iter_csv, write_spreadsheet
+    if file_format == 'csv':
+        # A plain iterator: Starlette iterates it in a thread, so the scoring and MongoDB reads don't block the loop
+        return StreamingResponse(iter_csv(rows), media_type=spreadsheet_media_types['csv'],
+                                 headers={"Content-Disposition": f'attachment; filename="{filename}.csv"'})
+
+    # xlsx files can only be sent once complete; the write-only workbook is built on disk
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        await asyncio.to_thread(write_spreadsheet, rows, path, 'xlsx')
+    except BaseException:
+        os.remove(path)
+        raise
+    return FileResponse(path, media_type=spreadsheet_media_types['xlsx'], filename=f"{filename}.xlsx",
+                        background=BackgroundTask(os.remove, path))
+
+
+@app.get("/api/nutrient-analysis/export")
+async def export_nutrient_analysis(format: Literal['csv', 'xlsx'] = 'csv', profile_id: str = DEFAULT_PROFILE):
+    """Threshold analysis, per-serving values and %RDA of every product in the catalogue (no LLM calls)."""
+    from spreadsheets import iter_catalogue_rows, SPREADSHEET_CHUNK_SIZE
+    profile_positions([profile_id])
+    require_spreadsheet_formats(format)
+    return await spreadsheet_response(iter_catalogue_rows(SPREADSHEET_CHUNK_SIZE, profile_id), format, "nutrient-analysis")
+
+
+@app.post("/api/nutrient-analysis/import")
+async def import_label_spreadsheet(request: Request, input_format: Literal['csv', 'xlsx'] = 'csv',
+                                   output_format: Literal['csv', 'xlsx'] = 'csv', profile_id: str = DEFAULT_PROFILE):
+    """Score a spreadsheet of label data sent as the request body (see spreadsheets.py for the columns)."""
+    from spreadsheets import iter_label_rows
+    profile_positions([profile_id])
+    require_spreadsheet_formats(input_format, output_format)
+    # The upload is spooled to disk, xlsx files can't be read as a stream
+    fd, path = tempfile.mkstemp(suffix=f".{input_format}")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in request.stream():
+                f.write(chunk)
+        if input_format == 'xlsx' and not zipfile.is_zipfile(path):
+            raise HTTPException(status_code=400, detail="Request body is not an xlsx file")
+    except BaseException:
+        os.remove(path)
+        raise
+    return await spreadsheet_response(remove_when_done(iter_label_rows(path, input_format, profile_id=profile_id), path),
+                                      output_format, "label-scores")
+
+
+@app.get("/api/profiles")
+async def get_profiles():
+    return list_profiles()
+
+
+@app.get("/api/nutrient-analysis/profiles")
+async def nutrient_analysis_profiles(product_id: str, profile_ids: Annotated[Optional[List[str]], Query()] = None):
+    """Threshold analysis and %RDA of one product for several profiles (all of them by default)."""
+    requested_profile_ids = profile_ids or list(profile_index)
+    profile_positions(requested_profile_ids)
+    product_info_from_db = await fetch_product(product_id)
+    if product_info_from_db is None:
+        raise HTTPException(status_code=404, detail=f"Product {product_id} not found")
+    if not product_info_from_db.get('nutritionalInformation'):
+        raise HTTPException(status_code=422, detail=CORRUPT_PRODUCT_MESSAGE)
+
+    results = await profile_nutrient_analysis(product_info_from_db, requested_profile_ids)
+    if results is None:
+        raise HTTPException(status_code=422, detail=CORRUPT_PRODUCT_MESSAGE)
+    return {'productId': product_id, 'profiles': results}
+
+
+@app.get("/api/extraction-stats")
+async def get_extraction_stats():
+    return extraction_stats
+
+
+@app.get("/api/cache-stats")
+async def get_cache_stats():
+    # Counting the persistent entries is a SQLite query
+    return await asyncio.to_thread(result_cache.get_stats)
+
+
+@app.get("/api/coalescing-stats")
+async def get_coalescing_stats():
+    return {
+        'extraction': dict(extraction_flights.stats, inFlight=len(extraction_flights)),
+        'analysis': dict(analysis_flights.stats, inFlight=len(analysis_flights)),
+    }
+
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
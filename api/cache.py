@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+def canonical_hash(*parts: Any) -> str:
+    """Stable sha256 of JSON-serialisable parts, independent of dict key order and whitespace."""
+    payload = json.dumps(parts, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LRUCache:
+    """In-process LRU tier with a per-entry TTL, a maximum entry count and a maximum total size in bytes."""
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024, ttl: float = 24 * 3600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size_bytes = 0
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            expires_at, size, value = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                self.size_bytes -= size
+                self.stats['expirations'] += 1
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return value
+
+    def set(self, key: str, value: Any, size: int, ttl: Optional[float] = None):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size_bytes -= old[1]
+            self._entries[key] = (time.time() + (ttl or self.ttl), size, value)
+            self.size_bytes += size
+            while len(self._entries) > self.max_entries or self.size_bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self.size_bytes -= evicted_size
+                self.stats['evictions'] += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteStore:
+    """Persistent tier storing JSON values in a SQLite file. Any object with the same get/set methods can replace it."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self.stats = {'hits': 0, 'misses': 0, 'expirations': 0}
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+            if row[1] < time.time():
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._conn.commit()
+                self.stats['expirations'] += 1
+                self.stats['misses'] += 1
+                return None
+            self.stats['hits'] += 1
+            return row[0]
+
+    def set(self, key: str, value: str, ttl: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, time.time() + ttl)
+            )
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+
+class ResultCache:
+    """
+    Two-tier cache: an in-process LRU in front of an optional persistent store.
+
+    Both tiers hold the serialized JSON, so every get returns a fresh copy that callers may modify.
+    The persistent tier is blocking I/O and runs in a worker thread, off the event loop.
+    """
+
+    def __init__(self, memory: LRUCache, persistent=None, ttl: float = 24 * 3600):
+        self.memory = memory
+        self.persistent = persistent
+        self.ttl = ttl
+        self.stats = {'hits': 0, 'misses': 0}
+
+    async def get(self, key: str) -> Optional[Any]:
+        serialized = self.memory.get(key)
+        if serialized is None and self.persistent is not None:
+            serialized = await asyncio.to_thread(self.persistent.get, key)
+            if serialized is not None:
+                # Promote to the in-process tier
+                self.memory.set(key, serialized, len(serialized), self.ttl)
+        self.stats['hits' if serialized is not None else 'misses'] += 1
+        return json.loads(serialized) if serialized is not None else None
+
+    async def set(self, key: str, value: Any):
+        serialized = json.dumps(value, separators=(',', ':'))
+        self.memory.set(key, serialized, len(serialized), self.ttl)
+        if self.persistent is not None:
+            await asyncio.to_thread(self.persistent.set, key, serialized, self.ttl)
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = {
+            **self.stats,
+            'memory': dict(self.memory.stats, entries=len(self.memory), bytes=self.memory.size_bytes),
+        }
+        if self.persistent is not None:
+            stats['persistent'] = dict(self.persistent.stats, entries=len(self.persistent))
+        return stats
+
+
+def create_cache_from_env() -> ResultCache:
+    """
+    Build the cache from environment variables:
+        NUTRIENT_CACHE_MAX_ENTRIES, NUTRIENT_CACHE_MAX_BYTES, NUTRIENT_CACHE_TTL (seconds)
+        NUTRIENT_CACHE_DB: path of the SQLite file for the persistent tier (disabled if unset)
+    """
+    ttl = float(os.getenv("NUTRIENT_CACHE_TTL", 7 * 24 * 3600))
+    memory = LRUCache(
+        max_entries=int(os.getenv("NUTRIENT_CACHE_MAX_ENTRIES", 1024)),
+        max_bytes=int(os.getenv("NUTRIENT_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+        ttl=ttl
+    )
+    db_path = os.getenv("NUTRIENT_CACHE_DB")
+    persistent = SQLiteStore(db_path) if db_path else None
+    return ResultCache(memory, persistent, ttl)
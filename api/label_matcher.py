@@ -0,0 +1,224 @@
+import os
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+
+from rda import daily_values
+
+logger = logging.getLogger(__name__)
+
+# Embedding-based fallback for nutrient label names the rules in nutrient_extractor.py don't recognise,
+# e.g. "Na" or "Lipids (total)". The model always runs on CPU. It is loaded by a background thread
+# (start_loading), and async callers run the encoding in a worker thread (match_labels_async), so
+# neither ever blocks the event loop.
+
+LABEL_MATCHER_MODEL = os.getenv("LABEL_MATCHER_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+# Minimum cosine similarity for a label to be mapped onto a nutrient
+LABEL_MATCH_THRESHOLD = float(os.getenv("LABEL_MATCH_THRESHOLD", 0.75))
+# Where the canonical embeddings are persisted
+LABEL_EMBEDDINGS_DIR = os.getenv("LABEL_EMBEDDINGS_DIR", os.path.join(os.path.expanduser("~"), ".cache", "nutrient-analysis"))
+# After a failed load (e.g. the model can't be downloaded) the next attempt waits this many seconds,
+# doubling after every further failure up to LABEL_MATCHER_MAX_RETRY_INTERVAL
+LABEL_MATCHER_RETRY_INTERVAL = float(os.getenv("LABEL_MATCHER_RETRY_INTERVAL", 30))
+LABEL_MATCHER_MAX_RETRY_INTERVAL = float(os.getenv("LABEL_MATCHER_MAX_RETRY_INTERVAL", 3600))
+# Longest a request waits for the model to load (seconds); after that its labels stay unmatched
+# while the load carries on in the background
+LABEL_MATCHER_LOAD_WAIT = float(os.getenv("LABEL_MATCHER_LOAD_WAIT", 10))
+LABEL_MATCH_CACHE_SIZE = 4096
+
+# Descriptions of the nutrients of daily_values in rda.py (plus salt, which is converted to sodium)
+canonical_phrases = {
+    'energy': ['energy', 'calories', 'energy value', 'kcal'],
+    'protein': ['protein', 'proteins'],
+    'carbohydrates': ['carbohydrates', 'total carbohydrate', 'carbs'],
+    'addedSugars': ['added sugars', 'added sugar'],
+    'dietaryFiber': ['dietary fiber', 'dietary fibre', 'fibre'],
+    'totalFat': ['total fat', 'fat', 'lipids'],
+    'saturatedFat': ['saturated fat', 'saturated fatty acids', 'SFA'],
+    'monounsaturatedFat': ['monounsaturated fat', 'MUFA'],
+    'polyunsaturatedFat': ['polyunsaturated fat', 'PUFA'],
+    'transFat': ['trans fat', 'trans fatty acids'],
+    'sodium': ['sodium', 'Na'],
+    'salt': ['salt', 'sodium chloride'],
+}
+canonical_keys = [key for key in list(daily_values) + ['salt'] for _ in canonical_phrases[key]]
+canonical_texts = [phrase for key in list(daily_values) + ['salt'] for phrase in canonical_phrases[key]]
+
+_model = None
+_canonical_embeddings = None
+_lock = threading.Lock()
+
+_loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="label-matcher")
+_load_future: Optional[Future] = None
+_load_failures = 0
+_retry_at = 0.0
+_load_lock = threading.Lock()
+
+# Label -> (nutrient key or None, cosine similarity) of the LABEL_MATCH_CACHE_SIZE labels matched or
+# looked up most recently, least recently used first
+_matches: "OrderedDict[str, Tuple[Optional[str], float]]" = OrderedDict()
+_matches_lock = threading.Lock()
+
+
+def get_model():
+    global _model
+    if _model is None:
+        with _lock:
+            if _model is None:
+                from sentence_transformers import SentenceTransformer
+                logger.info("label_matcher_load model=%s", LABEL_MATCHER_MODEL)
+                _model = SentenceTransformer(LABEL_MATCHER_MODEL, device="cpu")
+    return _model
+
+
+def embeddings_path() -> str:
+    digest = hashlib.sha256("\n".join([LABEL_MATCHER_MODEL] + canonical_texts).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(LABEL_EMBEDDINGS_DIR, f"canonical_embeddings_{digest}.npy")
+
+
+def get_canonical_embeddings() -> np.ndarray:
+    """Normalized embeddings of canonical_texts, computed once and memory-mapped from disk afterwards."""
+    global _canonical_embeddings
+    if _canonical_embeddings is None:
+        path = embeddings_path()
+        if os.path.exists(path):
+            _canonical_embeddings = np.load(path, mmap_mode="r")
+        else:
+            embeddings = get_model().encode(canonical_texts, normalize_embeddings=True, convert_to_numpy=True)
+            embeddings = embeddings.astype(np.float32)
+            try:
+                os.makedirs(LABEL_EMBEDDINGS_DIR, exist_ok=True)
+                # Write to a temporary file first so concurrent workers never load a partial file
+                tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+                np.save(tmp_path, embeddings)
+                os.replace(tmp_path, path)
+                _canonical_embeddings = np.load(path, mmap_mode="r")
+            except OSError as e:
+                logger.warning("label_matcher_persist_failed path=%s error=%s", path, e)
+                _canonical_embeddings = embeddings
+    return _canonical_embeddings
+
+
+def load():
+    global _load_failures, _retry_at
+    try:
+        get_model()
+        get_canonical_embeddings()
+    except Exception as e:
+        with _load_lock:
+            _load_failures += 1
+            retry_interval = min(LABEL_MATCHER_RETRY_INTERVAL * 2 ** (_load_failures - 1), LABEL_MATCHER_MAX_RETRY_INTERVAL)
+            _retry_at = time.monotonic() + retry_interval
+        logger.warning("label_matcher_unavailable error=%s failures=%d retry_in=%.0f", e, _load_failures, retry_interval)
+        raise
+    with _load_lock:
+        _load_failures = 0
+
+
+def start_loading() -> Optional[Future]:
+    """
+    Load the model and canonical embeddings in the background thread, if not already loaded or loading.
+    Returns the future of the load, or None while waiting to retry a failed load.
+    """
+    global _load_future
+    with _load_lock:
+        future = _load_future
+        if future is not None and not (future.done() and (future.cancelled() or future.exception() is not None)):
+            return future
+        if time.monotonic() < _retry_at:
+            return None
+        _load_future = _loader.submit(load)
+        return _load_future
+
+
+def wait_until_loaded() -> bool:
+    """Blocking: whether the matcher can be used. Not for the event loop, see match_labels_async."""
+    future = start_loading()
+    if future is None:
+        return False
+    try:
+        future.result()
+        return True
+    except Exception:
+        return False
+
+
+def cached_match(label: str) -> Optional[Tuple[Optional[str], float]]:
+    with _matches_lock:
+        match = _matches.get(label)
+        if match is not None:
+            _matches.move_to_end(label)
+        return match
+
+
+def remember_match(label: str, match: Tuple[Optional[str], float]):
+    with _matches_lock:
+        _matches[label] = match
+        _matches.move_to_end(label)
+        while len(_matches) > LABEL_MATCH_CACHE_SIZE:
+            # Drop the least recently used match
+            _matches.popitem(last=False)
+
+
+def match_labels(labels: Iterable[str]):
+    """Blocking: match the labels not matched yet, with one call of the model. The model must be loaded."""
+    labels = [label for label in dict.fromkeys(labels) if label not in _matches]
+    if not labels:
+        return
+    embeddings = get_model().encode(labels, normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+    similarities = embeddings @ np.asarray(get_canonical_embeddings()).T
+    for label, row in zip(labels, similarities):
+        best = int(np.argmax(row))
+        score = float(row[best])
+        key = canonical_keys[best] if score >= LABEL_MATCH_THRESHOLD else None
+        logger.debug("label_match label=%r key=%s score=%.3f", label, key, score)
+        remember_match(label, (key, score))
+
+
+def match_label(label: str) -> Tuple[Optional[str], float]:
+    """Blocking: return (nutrient key or None, cosine similarity) for a label name."""
+    label = label.strip()
+    if not label:
+        return None, 0.0
+    match = cached_match(label)
+    if match is None:
+        match_labels([label])
+        match = cached_match(label)
+    return match or (None, 0.0)
+
+
+async def match_labels_async(labels: Iterable[str]) -> bool:
+    """
+    Match labels without blocking the event loop: waits for the background load (at most
+    LABEL_MATCHER_LOAD_WAIT), then encodes in a worker thread. Returns False if the matcher is
+    unavailable or not ready (the labels then stay unmatched).
+    """
+    labels = [label.strip() for label in labels if label.strip() and label.strip() not in _matches]
+    if not labels:
+        return True
+    future = start_loading()
+    if future is None:
+        return False
+    try:
+        # Shielded: a request that times out or is cancelled must not cancel the shared load
+        await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), LABEL_MATCHER_LOAD_WAIT)
+    except asyncio.TimeoutError:
+        logger.info("label_matcher_not_ready waited=%.0f", LABEL_MATCHER_LOAD_WAIT)
+        return False
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        return False
+    try:
+        await asyncio.to_thread(match_labels, labels)
+    except Exception as e:
+        logger.warning("label_matcher_error error=%s", e)
+        return False
+    return True
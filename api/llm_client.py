@@ -0,0 +1,217 @@
+import os
+import json
+import random
+import asyncio
+import logging
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Any, Awaitable, Callable, Optional
+
+from metrics import record_llm_usage
+
+logger = logging.getLogger(__name__)
+
+# Per-call timeouts (seconds)
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 45.0))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", 5.0))
+# Shared connection pool across all requests of the process
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 100))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", 20))
+# Process-wide limit on in-flight LLM calls
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", 32))
+# Retry/backoff for rate-limited or transient LLM failures
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 5))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", 1.0))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", 30.0))
+# Longest a streamed completion may take to generate (seconds), and so hold its concurrency slots
+LLM_STREAM_TIMEOUT = float(os.getenv("LLM_STREAM_TIMEOUT", 60.0))
+
+_client = None
+_http_client = None
+_retryable_errors = None
+_concurrency_limit = asyncio.Semaphore(LLM_CONCURRENCY)
+
+
+def get_client():
+    """
+    Return the process-wide AsyncOpenAI client, creating it on first use.
+    Set OPENAI_BASE_URL to point it at a local fake server for offline testing.
+    """
+    global _client, _http_client
+    if _client is None:
+        # openai and httpx are imported here rather than at module load to keep cold starts short
+        import httpx
+        from openai import AsyncOpenAI
+
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                                max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS),
+            timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+        )
+        _client = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            base_url=os.getenv("OPENAI_BASE_URL") or None,
+            http_client=_http_client,
+            # Retries are handled by create_chat_completion so they respect the concurrency limit
+            max_retries=0
+        )
+    return _client
+
+
+def set_client(client):
+    """Replace the client, e.g. with an in-process fake exposing `chat.completions.create`."""
+    global _client, _http_client
+    _client = client
+    _http_client = None
+
+
+async def close_client():
+    global _client, _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+    _client = None
+    _http_client = None
+
+
+def retryable_errors():
+    """Rate-limit and transient errors worth retrying (imported lazily, see get_client)."""
+    global _retryable_errors
+    if _retryable_errors is None:
+        from openai import RateLimitError, APITimeoutError, APIConnectionError, InternalServerError
+        _retryable_errors = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+    return _retryable_errors
+
+
+def retry_after_seconds(error) -> Optional[float]:
+    # Honour the Retry-After header sent with 429 responses
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def request_size(messages) -> int:
+    return len(json.dumps(messages, ensure_ascii=False).encode("utf-8"))
+
+
+def backoff_delay(error, attempt: int) -> float:
+    delay = retry_after_seconds(error)
+    if delay is None:
+        delay = min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+    return delay
+
+
+@asynccontextmanager
+async def llm_slot(llm_semaphore: asyncio.Semaphore = None):
+    """Hold the process-wide concurrency limit and, if given, llm_semaphore (e.g. the limit of a batch request)."""
+    if llm_semaphore is None:
+        async with _concurrency_limit:
+            yield
+    else:
+        # Take the caller's slot first so waiting callers don't hold process-wide slots
+        async with llm_semaphore, _concurrency_limit:
+            yield
+
+
+async def with_retries(call: str, attempt_call: Callable[[], Awaitable[Any]]):
+    """
+    Await attempt_call() until it succeeds, retrying rate-limit and transient errors with exponential backoff.
+    attempt_call takes its llm_slot itself, so that no slot is held while backing off.
+    """
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        try:
+            return await attempt_call()
+        except retryable_errors() as e:
+            if attempt == LLM_MAX_RETRIES:
+                raise
+            delay = backoff_delay(e, attempt)
+            logger.warning("llm_retry call=%s error=%s delay=%.1f attempt=%d max_retries=%d",
+                           call, type(e).__name__, delay, attempt + 1, LLM_MAX_RETRIES)
+            await asyncio.sleep(delay)
+
+
+async def create_chat_completion(llm_semaphore: asyncio.Semaphore = None, timeout: float = None, call: str = "chat", **kwargs):
+    """
+    Call the chat completions API, retrying rate-limit and transient errors with exponential backoff.
+    Token usage and payload sizes are recorded in the metrics under `call`.
+
+    Each attempt holds the process-wide concurrency limit and, if given, llm_semaphore
+    (e.g. the limit of a batch request); neither is held while backing off.
+    Cancelling the calling task aborts the HTTP request.
+    """
+    client = get_client()
+
+    async def attempt_call():
+        async with llm_slot(llm_semaphore):
+            return await client.chat.completions.create(timeout=timeout or LLM_TIMEOUT, **kwargs)
+
+    response = await with_retries(call, attempt_call)
+    content = response.choices[0].message.content or ""
+    record_llm_usage(call, getattr(response, "usage", None), request_size(kwargs.get("messages")),
+                     len(content.encode("utf-8")))
+    return response
+
+
+async def stream_chat_completion(llm_semaphore: asyncio.Semaphore = None, timeout: float = None, call: str = "chat", **kwargs):
+    """
+    Stream a chat completion, yielding the content of each delta.
+
+    Opening the stream is retried like create_chat_completion, without holding a slot while backing off.
+    A background task reads the stream into a buffer as fast as the API sends it, holding the slots
+    only until the last chunk has arrived (at most LLM_STREAM_TIMEOUT seconds); a slow consumer, e.g. an
+    SSE client on a mobile connection, reads from the buffer without holding them.
+    Closing the generator early aborts the stream.
+    """
+    client = get_client()
+    buffer = asyncio.Queue()
+    end = object()
+
+    async def open_stream():
+        slot = AsyncExitStack()
+        await slot.enter_async_context(llm_slot(llm_semaphore))
+        try:
+            return slot, await client.chat.completions.create(stream=True, stream_options={"include_usage": True},
+                                                              timeout=timeout or LLM_TIMEOUT, **kwargs)
+        except BaseException:
+            await slot.aclose()
+            raise
+
+    async def read_stream(stream):
+        usage = None
+        response_bytes = 0
+        try:
+            async for chunk in stream:
+                # With include_usage the last chunk has no choices, only the usage
+                usage = getattr(chunk, "usage", None) or usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    response_bytes += len(chunk.choices[0].delta.content.encode("utf-8"))
+                    buffer.put_nowait(chunk.choices[0].delta.content)
+        finally:
+            record_llm_usage(call, usage, request_size(kwargs.get("messages")), response_bytes)
+            # Release the connection if the stream is aborted
+            close = getattr(stream, "close", None)
+            if close is not None:
+                await close()
+
+    async def read():
+        try:
+            slot, stream = await with_retries(call, open_stream)
+            async with slot:
+                await asyncio.wait_for(read_stream(stream), LLM_STREAM_TIMEOUT)
+        finally:
+            buffer.put_nowait(end)
+
+    reader = asyncio.ensure_future(read())
+    try:
+        while True:
+            text = await buffer.get()
+            if text is end:
+                break
+            yield text
+        # Raises the error of the stream, if any
+        await reader
+    finally:
+        # The consumer stopped early (e.g. the client disconnected), don't keep generating
+        reader.cancel()
@@ -0,0 +1,126 @@
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Sequence, Tuple
+
+# Minimal Prometheus-style metrics, rendered in the text exposition format by render_metrics()
+
+DEFAULT_LATENCY_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+BYTE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+_registry = []
+
+
+def _format_labels(labelnames: Sequence[str], labelvalues: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+stage_duration = Histogram("nutrient_analysis_stage_duration_seconds",
+                           "Duration of each stage of the nutrient analysis pipeline", ["stage"])
+stage_errors = Counter("nutrient_analysis_stage_errors_total", "Stages that raised an exception", ["stage"])
+llm_tokens = Histogram("nutrient_analysis_llm_tokens", "Tokens used per LLM call", ["call", "kind"], TOKEN_BUCKETS)
+llm_payload_bytes = Histogram("nutrient_analysis_llm_payload_bytes",
+                              "Size of LLM request messages and response content", ["call", "direction"], BYTE_BUCKETS)
+
+precomputed_lookups = Counter("nutrient_analysis_precomputed_lookups_total",
+                              "Analyses served from the materialized field (hit), from it but without narrative (partial), or computed live (miss)",
+                              ["result"])
+
+
+@contextmanager
+def timed(stage: str):
+    """Record the duration of the enclosed block (sync or awaited code) under the given stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        stage_errors.inc(stage=stage)
+        raise
+    finally:
+        stage_duration.observe(time.perf_counter() - start, stage=stage)
+
+
+def record_llm_usage(call: str, usage, request_bytes: int = None, response_bytes: int = None):
+    """Record token usage (an OpenAI `usage` object, may be None) and payload sizes of one LLM call."""
+    if usage is not None:
+        for kind in ("prompt_tokens", "completion_tokens"):
+            value = getattr(usage, kind, None)
+            if value is not None:
+                llm_tokens.observe(value, call=call, kind=kind.split("_")[0])
+        # Prompt tokens served from the provider's prompt cache
+        cached = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None)
+        if cached is not None:
+            llm_tokens.observe(cached, call=call, kind="cached")
+    if request_bytes is not None:
+        llm_payload_bytes.observe(request_bytes, call=call, direction="request")
+    if response_bytes is not None:
+        llm_payload_bytes.observe(response_bytes, call=call, direction="response")
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
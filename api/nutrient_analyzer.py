@@ -1,6 +1,10 @@
 import os
+import math
 import json
+import numpy as np
 from typing import List, Dict, Any
+from fastapi import HTTPException
+from scoring import threshold_nutrients, compile_table, to_column, score_thresholds, score_thresholds_scalar, present_values
 
 # Nutrient thresholds for solids and liquids
 thresholds = {
@@ -22,57 +26,63 @@ def calculate_percentage_difference(value: float, threshold: float) -> float:
         return None  # For nutrients without a threshold
     return ((value - threshold) / threshold) * 100
 
-# Function to analyze nutrients and calculate differences
-async def analyze_nutrients(product_type: str, calories: float, sugar: float, salt: float, serving_size: float):
-    threshold_data = thresholds.get(product_type)
-    if not threshold_data:
-        raise HTTPException(status_code=400, detail=f"Invalid product type: {product_type}")
+# Thresholds as arrays ordered by threshold_nutrients, one row per product type
+product_types = list(thresholds)
+threshold_array = np.array([compile_table(thresholds[product_type], threshold_nutrients) for product_type in product_types])
+threshold_lists = {product_type: row for product_type, row in zip(product_types, threshold_array.tolist())}
+
+# Sentences of the analysis string per nutrient: (above threshold, below threshold)
+analysis_sentences = {
+    'calories': ("Calories exceed the ICMR-defined threshold by {}%.", "Calories are {}% below the ICMR-defined threshold."),
+    'sugar': (" Sugar exceeds the ICMR-defined threshold by {}%.", "Sugar is {}% below the ICMR-defined threshold."),
+    'salt': (" Salt exceeds the ICMR-defined threshold by {}%.", "Salt is {}% below the ICMR-defined threshold."),
+}
 
-    # Calculate scaled values based on serving size
-    scaled_calories = (calories / serving_size) * 100 if calories is not None else None
-    scaled_sugar = (sugar / serving_size) * 100 if sugar is not None else None
-    scaled_salt = (salt / serving_size) * 100 if salt is not None else None
+# analysis_sentences split around the percentage, formatted with f-strings (faster than str.format)
+analysis_sentence_parts = [tuple(tuple(sentence.split("{}")) for sentence in analysis_sentences[nutrient])
+                           for nutrient in threshold_nutrients]
 
-    nutrient_analysis = {}
+def format_nutrient_analysis(percentage_diff_row: List[float]) -> str:
     nutrient_analysis_str = ""
-    
-    # Analyze calories
-    if scaled_calories is not None:
-        nutrient_analysis['calories'] = {
-            'value': scaled_calories,
-            'threshold': threshold_data['calories'],
-            'difference': scaled_calories - threshold_data['calories'],
-            'percentageDiff': calculate_percentage_difference(scaled_calories, threshold_data['calories'])
-        }
-        if nutrient_analysis['calories']['percentageDiff'] > 0:
-            nutrient_analysis_str += f"Calories exceed the ICMR-defined threshold by {nutrient_analysis['calories']['percentageDiff']}%."
-        else:
-            nutrient_analysis_str += f"Calories are {abs(nutrient_analysis['calories']['percentageDiff'])}% below the ICMR-defined threshold."
-            
-    # Analyze sugar
-    if scaled_sugar is not None:
-        nutrient_analysis['sugar'] = {
-            'value': scaled_sugar,
-            'threshold': threshold_data['sugar'],
-            'difference': scaled_sugar - threshold_data['sugar'],
-            'percentageDiff': calculate_percentage_difference(scaled_sugar, threshold_data['sugar'])
-        }
-        if nutrient_analysis['sugar']['percentageDiff'] > 0:
-            nutrient_analysis_str += f" Sugar exceeds the ICMR-defined threshold by {nutrient_analysis['sugar']['percentageDiff']}%."
-        else:
-            nutrient_analysis_str += f"Sugar is {abs(nutrient_analysis['sugar']['percentageDiff'])}% below the ICMR-defined threshold."
-            
-    # Analyze salt
-    if scaled_salt is not None:
-        nutrient_analysis['salt'] = {
-            'value': scaled_salt,
-            'threshold': threshold_data['salt'],
-            'difference': scaled_salt - threshold_data['salt'],
-            'percentageDiff': calculate_percentage_difference(scaled_salt, threshold_data['salt'])
-        }
-        if nutrient_analysis['salt']['percentageDiff'] > 0:
-            nutrient_analysis_str += f" Salt exceeds the ICMR-defined threshold by {nutrient_analysis['salt']['percentageDiff']}%."
+    for ((above_prefix, above_suffix), (below_prefix, below_suffix)), percentage_diff in zip(analysis_sentence_parts, percentage_diff_row):
+        if math.isnan(percentage_diff):
+            continue
+        if percentage_diff > 0:
+            nutrient_analysis_str += f"{above_prefix}{percentage_diff}{above_suffix}"
         else:
-            nutrient_analysis_str += f"Salt is {abs(nutrient_analysis['salt']['percentageDiff'])}% below the ICMR-defined threshold."
+            nutrient_analysis_str += f"{below_prefix}{abs(percentage_diff)}{below_suffix}"
+    return nutrient_analysis_str
 
-    return {"analysis": nutrient_analysis_str}
+# Threshold analysis of a product: the text, and the percentage differences as numbers for the ICMR prompt
+# (see prompts.icmr_payload)
+def nutrient_analysis_result(percentage_diff_row: List[float]) -> Dict[str, Any]:
+    return {"analysis": format_nutrient_analysis(percentage_diff_row),
+            "percentageDiffs": present_values(threshold_nutrients, percentage_diff_row)}
+
+# Function to analyze many products against their thresholds in one pass
+def analyze_nutrients_bulk(product_types_list: List[str], calories: List[float], sugar: List[float],
+                           salt: List[float], serving_sizes: List[float], threshold_rows: np.ndarray = None):
+    if threshold_rows is None:
+        for product_type in product_types_list:
+            if product_type not in thresholds:
+                raise HTTPException(status_code=400, detail=f"Invalid product type: {product_type}")
+        threshold_rows = threshold_array[[product_types.index(product_type) for product_type in product_types_list]]
+
+    values = np.column_stack([to_column(calories), to_column(sugar), to_column(salt)])
+    serving_sizes = np.asarray(serving_sizes, dtype=float)
+    _, _, percentage_diff = score_thresholds(values, serving_sizes, threshold_rows)
+    # A product without a valid serving size can't be compared to the thresholds at all
+    return [nutrient_analysis_result(row) if valid_serving else {"analysis": 'N/A', "percentageDiffs": {}}
+            for row, valid_serving in zip(percentage_diff.tolist(), (serving_sizes > 0).tolist())]
+
+# Function to analyze nutrients and calculate differences
+async def analyze_nutrients(product_type: str, calories: float, sugar: float, salt: float, serving_size: float,
+                            threshold_rows: np.ndarray = None):
+    if threshold_rows is None:
+        threshold_row = threshold_lists.get(product_type)
+    else:
+        threshold_row = threshold_rows.tolist()[0] if threshold_rows.shape[0] == 1 else None
+    percentage_diff = score_thresholds_scalar([calories, sugar, salt], serving_size, threshold_row) if threshold_row else None
+    if percentage_diff is not None:
+        return nutrient_analysis_result(percentage_diff)
+    return analyze_nutrients_bulk([product_type], [calories], [sugar], [salt], [serving_size], threshold_rows)[0]
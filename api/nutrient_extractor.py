@@ -0,0 +1,300 @@
+import os
+import re
+import asyncio
+import logging
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Tuple
+
+# Nutrients expected in 'nutritionPerServing' (see scale_nutrition in rda.py)
+nutrient_name_list = [
+    'energy', 'protein', 'carbohydrates', 'addedSugars', 'dietaryFiber',
+    'totalFat', 'saturatedFat', 'monounsaturatedFat', 'polyunsaturatedFat',
+    'transFat', 'sodium'
+]
+
+# Nutrients that must be on the label for the rule-based extraction to be trusted.
+# The others are frequently omitted from Indian labels and default to 0.
+required_nutrients = ['protein', 'carbohydrates', 'totalFat', 'sodium']
+
+# Label synonyms for each nutrient, checked in order so that the more specific
+# names ("monounsaturated fat", "added sugar") win over the generic ones ("fat", "sugar").
+# Phrases are matched as whole words (plural included), so "saturated fat" doesn't match
+# "Unsaturated Fat" and "fat" doesn't match "Fatty acids"; short abbreviations are matched as
+# whole words only. A label containing one of the excluded phrases is not mapped to the nutrient,
+# e.g. "Calories from Fat" is neither the energy nor the fat content of the product.
+fat_energy_labels = ['from fat', 'from saturated fat']
+nutrient_synonyms = [
+    ('monounsaturatedFat', ['monounsaturated', 'mono unsaturated', 'mono-unsaturated'], ['mufa'], []),
+    ('polyunsaturatedFat', ['polyunsaturated', 'poly unsaturated', 'poly-unsaturated'], ['pufa'], []),
+    ('transFat', ['trans fat', 'trans-fat', 'trans fatty'], ['tfa'], []),
+    ('saturatedFat', ['saturated fat', 'saturated fatty', 'saturates'], ['sfa'], fat_energy_labels),
+    ('addedSugars', ['added sugar'], [], []),
+    ('dietaryFiber', ['fiber', 'fibre'], [], []),
+    ('energy', ['energy', 'calorie'], ['kcal', 'kj'], fat_energy_labels),
+    ('protein', ['protein'], [], []),
+    ('carbohydrates', ['carbohydrate'], ['carbs', 'cho'], []),
+    ('totalFat', ['total fat', 'fat', 'lipid'], [], ['unsaturated'] + fat_energy_labels),
+    ('sodium', ['sodium'], ['na'], []),
+    ('salt', ['salt'], [], []),
+]
+
+
+def words_pattern(phrases: List[str], plural: bool = False) -> Optional[re.Pattern]:
+    if not phrases:
+        return None
+    suffix = 's?' if plural else ''
+    return re.compile(r'\b(?:' + '|'.join(re.escape(phrase) for phrase in phrases) + r')' + suffix + r'\b')
+
+
+# nutrient_synonyms compiled: (key, synonyms, abbreviations, excluded phrases), None for empty lists
+synonym_patterns = [(key, words_pattern(phrases, plural=True), words_pattern(abbreviations), words_pattern(excluded))
+                    for key, phrases, abbreviations, excluded in nutrient_synonyms]
+
+# Micronutrients etc. on labels that no nutrient is ever extracted from; also left out of the extraction prompt (prompts.py)
+unused_labels = [
+    'cholesterol', 'calcium', 'iron', 'vitamin', 'potassium', 'magnesium', 'zinc',
+    'phosphorus', 'caffeine', 'folic', 'iodine'
+]
+
+# Label names that are known but not used; they are never sent to the semantic matcher
+# (e.g. "Total Sugars" must not become addedSugars, "Unsaturated Fat" not saturatedFat)
+ignored_labels = ['sugar', 'starch', 'polyol', 'omega', 'unsaturated'] + unused_labels + fat_energy_labels
+
+# Embedding-based matching (label_matcher.py) for labels the rules don't recognise.
+# Off by default on Vercel, where the model would be downloaded by the serverless function.
+SEMANTIC_LABEL_MATCHING = os.getenv("SEMANTIC_LABEL_MATCHING", "0" if os.getenv("VERCEL") else "1").lower() in ("1", "true", "yes")
+
+# Bump this whenever the rules above change so that cached extractions made with the old rules are not served
+LABEL_RULES_VERSION = "2"
+
+logger = logging.getLogger(__name__)
+
+# Unit conversion factors to grams
+mass_units = {
+    'g': 1.0, 'gm': 1.0, 'gms': 1.0, 'gram': 1.0, 'grams': 1.0,
+    'mg': 1e-3, 'mcg': 1e-6, 'ug': 1e-6, 'µg': 1e-6, 'kg': 1e3,
+}
+
+# Unit conversion factors to kcal
+energy_units = {
+    'kcal': 1.0, 'cal': 1.0, 'calories': 1.0, 'kcals': 1.0,
+    'kj': 1 / 4.184,
+}
+
+# 1 g of salt contains 400 mg of sodium
+SODIUM_MG_PER_G_SALT = 400
+
+basis_pattern = re.compile(r'(\d+(?:\.\d+)?)\s*(g|gm|gms|ml)\b')
+
+
+# Catalogues repeat the same few label names, bulk scoring looks each one up many times
+@lru_cache(maxsize=4096)
+def match_nutrient(label: str) -> Optional[str]:
+    """Map a label name such as 'Saturated Fat' or 'Dietary Fibre' to a nutrient key, or None."""
+    label = label.lower().strip()
+    if not label:
+        return None
+    for key, phrases, abbreviations, excluded in synonym_patterns:
+        if not (phrases.search(label) or (abbreviations is not None and abbreviations.search(label))):
+            continue
+        if excluded is not None and excluded.search(label):
+            continue
+        return key
+    return None
+
+
+def semantic_candidate(label: str) -> Optional[str]:
+    """The normalized label if it would be sent to the semantic matcher, else None."""
+    if not SEMANTIC_LABEL_MATCHING or match_nutrient(label) is not None:
+        return None
+    normalized = label.lower().strip()
+    if not normalized or any(ignored in normalized for ignored in ignored_labels):
+        return None
+    return normalized
+
+
+def on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+def resolve_label(label: str) -> Optional[str]:
+    """
+    match_nutrient, falling back to the semantic matcher for unrecognised label names.
+    On the event loop only labels already matched by resolve_labels are used; elsewhere (threads,
+    command line tools) the matcher runs here and may block while the model loads.
+    """
+    key = match_nutrient(label)
+    if key is not None:
+        return key
+    normalized = semantic_candidate(label)
+    if normalized is None:
+        return None
+    try:
+        import label_matcher
+        match = label_matcher.cached_match(normalized)
+        if match is None:
+            if on_event_loop() or not label_matcher.wait_until_loaded():
+                # Not matched yet, or the matcher is unavailable: keep serving with the rules only
+                return None
+            match = label_matcher.match_label(normalized)
+        return match[0]
+    except Exception as e:
+        logger.warning("semantic_label_matching_error label=%r error=%s", normalized, e)
+        return None
+
+
+def label_names(nutritional_information: List[Dict[str, Any]]) -> List[str]:
+    """Every string extract_nutrition_per_serving and find_product_nutrients may pass to resolve_label."""
+    names = []
+    for item in nutritional_information or []:
+        if not isinstance(item, dict):
+            continue
+        names.append(str(item.get('name', '')))
+        for entry in (item.get('values') or [])[1:]:
+            base = entry.get('base', '') if isinstance(entry, dict) else ''
+            if isinstance(base, str) and parse_basis(base, 1.0) is None:
+                names.append(base)
+    return names
+
+
+async def resolve_labels(nutritional_information: List[Dict[str, Any]]) -> bool:
+    """
+    Run the semantic matcher for the label names the rules don't recognise, off the event loop, so
+    that resolve_label finds them afterwards. Returns False if the matcher is unavailable.
+    """
+    if not SEMANTIC_LABEL_MATCHING:
+        return True
+    import label_matcher
+    candidates = {semantic_candidate(name) for name in label_names(nutritional_information)}
+    candidates = [label for label in candidates if label is not None and label_matcher.cached_match(label) is None]
+    if not candidates:
+        return True
+    return await label_matcher.match_labels_async(candidates)
+
+
+def label_matching_version():
+    """Identifies the label resolution for cache keys: results of another matcher must not be served."""
+    if not SEMANTIC_LABEL_MATCHING:
+        return ['rules', LABEL_RULES_VERSION]
+    from label_matcher import LABEL_MATCHER_MODEL, LABEL_MATCH_THRESHOLD
+    return ['semantic', LABEL_RULES_VERSION, LABEL_MATCHER_MODEL, LABEL_MATCH_THRESHOLD]
+
+
+def convert_unit(key: str, value: float, unit: str) -> Optional[float]:
+    """Convert a label value to kcal (energy), mg (sodium) or g (everything else)."""
+    unit = (unit or '').lower().strip()
+    if key == 'energy':
+        if not unit:
+            return value
+        factor = energy_units.get(unit)
+        return value * factor if factor is not None else None
+
+    factor = mass_units.get(unit) if unit else 1.0
+    if factor is None:
+        return None
+    if not unit and key == 'sodium':
+        # Sodium is conventionally printed in mg
+        return value
+    grams = value * factor
+    return grams * 1000 if key == 'sodium' else grams
+
+
+def parse_basis(base: str, serving_size: float) -> Optional[float]:
+    """Return the quantity (g or ml) a label value refers to, e.g. 'per 100 g' -> 100."""
+    base = (base or '').lower()
+    amount = basis_pattern.search(base)
+    if amount:
+        return float(amount.group(1))
+    if 'serv' in base or 'portion' in base:
+        return serving_size
+    return None
+
+
+def extract_nutrition_per_serving(nutritional_information: List[Dict[str, Any]],
+                                  serving_size: float) -> Tuple[Optional[Dict[str, float]], List[str]]:
+    """
+    Extract the values of nutrient_name_list from structured label data without calling the LLM.
+
+    Args:
+        nutritional_information: 'nutritionalInformation' list of the product document
+        serving_size: Serving size of the product, used for 'per serving' bases
+
+    Returns:
+        Tuple of the nutrition data in the same shape as the LLM response (or None if
+        the label could not be resolved) and the list of reasons it could not be resolved
+    """
+    unresolved = []
+    # (key, value in canonical unit, basis) per label entry; basis may be None until resolved
+    found = []
+
+    for item in nutritional_information or []:
+        name = item.get('name', '')
+        unit = item.get('unit', '')
+        values = item.get('values') or []
+        key = resolve_label(name)
+
+        item_basis = None
+        for position, entry in enumerate(values):
+            value = entry.get('value')
+            basis = parse_basis(entry.get('base', ''), serving_size)
+            if basis is not None:
+                item_basis = basis
+                entry_key = key
+            elif position == 0:
+                # First value without a recognisable base, e.g. {'base': '', 'value': 10}
+                entry_key = key
+            else:
+                # Nested sub-nutrient such as {'base': 'Saturated Fat', 'value': 6.8}
+                entry_key = resolve_label(entry.get('base', ''))
+            if entry_key is None:
+                continue
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                unresolved.append(f"non-numeric value for {name}")
+                continue
+            converted = convert_unit(entry_key, value, unit)
+            if converted is None:
+                unresolved.append(f"unknown unit '{unit}' for {name}")
+                continue
+            if entry_key == 'salt':
+                converted = converted * SODIUM_MG_PER_G_SALT
+            found.append([entry_key, converted, basis if basis is not None else item_basis])
+
+    # Entries without their own base share the basis used by the rest of the label
+    bases = [basis for _, _, basis in found if basis is not None]
+    if not bases:
+        return None, unresolved + ["no 'per 100 g' or 'per serving' basis found"]
+    reference_basis = max(set(bases), key=bases.count)
+    if reference_basis <= 0:
+        return None, unresolved + ["invalid basis"]
+
+    nutrition_data = {}
+    salt = None
+    for key, value, basis in found:
+        basis = basis if basis is not None else reference_basis
+        normalized = value * reference_basis / basis
+        if key == 'salt':
+            salt = normalized if salt is None else salt + normalized
+        elif key not in nutrition_data:
+            nutrition_data[key] = normalized
+
+    if 'sodium' not in nutrition_data and salt is not None:
+        nutrition_data['sodium'] = salt
+    if 'energy' not in nutrition_data and all(k in nutrition_data for k in ('protein', 'carbohydrates', 'totalFat')):
+        # Atwater factors
+        nutrition_data['energy'] = 4 * nutrition_data['protein'] + 4 * nutrition_data['carbohydrates'] + 9 * nutrition_data['totalFat']
+
+    missing = [key for key in ['energy'] + required_nutrients if key not in nutrition_data]
+    if missing:
+        return None, unresolved + [f"missing {', '.join(missing)}"]
+    if unresolved:
+        return None, unresolved
+
+    for key in nutrient_name_list:
+        nutrition_data.setdefault(key, 0)
+    nutrition_data = {key: round(nutrition_data[key], 4) for key in nutrient_name_list}
+    nutrition_data['servingSize'] = reference_basis
+    return nutrition_data, unresolved
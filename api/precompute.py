@@ -0,0 +1,188 @@
+"""
+Background worker that keeps the materialized analysis of every product up to date.
+
+Products are recomputed only when their nutrition data changed: the worker follows a MongoDB change
+stream, or polls the UPDATED_AT_FIELD timestamp when change streams are not available (standalone
+server). Results are written to PRECOMPUTED_FIELD of the product, where /api/nutrient-analysis
+picks them up (see fresh_precomputed in app.py).
+
+    pip install -r requirements-worker.txt
+    python api/precompute.py --narrative
+    python api/precompute.py --mode poll --poll-interval 60
+    python api/precompute.py --once        # backfill the whole catalogue and exit
+"""
+import os
+import asyncio
+import logging
+import argparse
+
+from app import compute_precomputed, fresh_precomputed, precomputed_narrative
+from product_store import (PRECOMPUTED_FIELD, UPDATED_AT_FIELD, save_precomputed, iter_all_products,
+                           find_products_updated_since, watch_products, close_client)
+from llm_client import close_client as close_llm_client
+from nutrient_extractor import SEMANTIC_LABEL_MATCHING
+
+logger = logging.getLogger("nutrient_analysis.precompute")
+
+# Also generate the ICMR narrative (one LLM call per changed product)
+PRECOMPUTE_NARRATIVE = os.getenv("PRECOMPUTE_NARRATIVE", "").lower() in ("1", "true", "yes")
+# Products recomputed concurrently
+PRECOMPUTE_CONCURRENCY = int(os.getenv("PRECOMPUTE_CONCURRENCY", 4))
+PRECOMPUTE_BATCH_SIZE = int(os.getenv("PRECOMPUTE_BATCH_SIZE", 500))
+PRECOMPUTE_POLL_INTERVAL = float(os.getenv("PRECOMPUTE_POLL_INTERVAL", 30))
+
+
+def is_up_to_date(product, narrative):
+    precomputed = fresh_precomputed(product)
+    if precomputed is None:
+        return False
+    return not narrative or precomputed['analysis'] is None or precomputed_narrative(precomputed, product)
+
+
+async def precompute_product(product, narrative, llm_semaphore=None):
+    """Recompute and store the analysis of one product document. Returns False if it was already up to date."""
+    if not isinstance(product.get('nutritionalInformation'), list) or not isinstance(product.get('servingSize'), dict):
+        return False
+    if is_up_to_date(product, narrative):
+        return False
+    precomputed = await compute_precomputed(product, narrative, llm_semaphore)
+    if precomputed is None:
+        # The semantic label matcher is unavailable; the product is left to the next backfill
+        logger.warning("precompute_skipped product_id=%s reason=labels_unresolved", product.get('_id'))
+        return False
+    await asyncio.to_thread(save_precomputed, product['_id'], precomputed)
+    return True
+
+
+async def precompute_products(products, narrative, concurrency):
+    """Returns the number of products that were recomputed."""
+    limit = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(product):
+        # Held for the whole product, so it also bounds the worker's LLM calls
+        async with limit:
+            return await precompute_product(product, narrative)
+
+    results = await asyncio.gather(*(run(product) for product in products), return_exceptions=True)
+    for product, result in zip(products, results):
+        if isinstance(result, Exception):
+            logger.error("precompute_error product_id=%s error=%s", product.get('_id'), result)
+    return sum(1 for result in results if result is True)
+
+
+def latest_position(products, position):
+    """(updatedAt, _id) of the most recently changed product, used as the polling watermark."""
+    for product in products:
+        updated_at = product.get(UPDATED_AT_FIELD)
+        if updated_at is not None and (position[0] is None or (updated_at, product['_id']) > position):
+            position = (updated_at, product['_id'])
+    return position
+
+
+async def backfill(narrative, concurrency, batch_size=PRECOMPUTE_BATCH_SIZE):
+    """Bring the whole catalogue up to date. Returns the polling watermark."""
+    cursor = iter_all_products(batch_size)
+    position = (None, None)
+    scanned = updated = 0
+    try:
+        while True:
+            products = await asyncio.to_thread(lambda: [product for _, product in zip(range(batch_size), cursor)])
+            if not products:
+                break
+            scanned += len(products)
+            updated += await precompute_products(products, narrative, concurrency)
+            position = latest_position(products, position)
+    finally:
+        cursor.close()
+    logger.info("precompute_backfill scanned=%d updated=%d", scanned, updated)
+    return position
+
+
+async def poll_changes(narrative, concurrency, position, interval=PRECOMPUTE_POLL_INTERVAL, batch_size=PRECOMPUTE_BATCH_SIZE):
+    """Recompute products whose UPDATED_AT_FIELD moved past the watermark, forever."""
+    while True:
+        products = await asyncio.to_thread(find_products_updated_since, position[0], position[1], batch_size)
+        if products:
+            updated = await precompute_products(products, narrative, concurrency)
+            logger.info("precompute_poll changed=%d updated=%d", len(products), updated)
+            position = latest_position(products, position)
+        if len(products) < batch_size:
+            await asyncio.sleep(interval)
+
+
+async def follow_change_stream(stream, narrative, concurrency, batch_size=PRECOMPUTE_BATCH_SIZE):
+    """Recompute products as their change events arrive, forever. Events are processed in small batches."""
+    while True:
+        products = []
+        while len(products) < batch_size:
+            change = await asyncio.to_thread(stream.try_next)
+            if change is None:
+                break
+            if change.get('fullDocument') is not None:
+                products.append(change['fullDocument'])
+        if products:
+            # Several events for one product in a batch: the lookup returns its current document each time
+            unique_products = list({str(product['_id']): product for product in products}.values())
+            updated = await precompute_products(unique_products, narrative, concurrency)
+            logger.info("precompute_changes events=%d updated=%d", len(products), updated)
+
+
+async def run_worker(mode="auto", narrative=PRECOMPUTE_NARRATIVE, concurrency=PRECOMPUTE_CONCURRENCY,
+                     poll_interval=PRECOMPUTE_POLL_INTERVAL, once=False):
+    stream = None
+    if mode in ("auto", "watch") and not once:
+        # Open the stream before the backfill so changes made meanwhile are not missed
+        try:
+            stream = await asyncio.to_thread(watch_products)
+        except Exception as e:
+            if mode == "watch":
+                raise
+            logger.warning("precompute_change_stream_unavailable error=%s fallback=poll field=%s", e, UPDATED_AT_FIELD)
+
+    if SEMANTIC_LABEL_MATCHING:
+        # Products are only stored with their labels resolved by the semantic matcher, load it before the backfill
+        from label_matcher import wait_until_loaded
+        if not await asyncio.to_thread(wait_until_loaded):
+            logger.warning("precompute_label_matcher_unavailable products=skipped_until_loaded")
+
+    try:
+        position = await backfill(narrative, concurrency)
+        if once:
+            return
+        if stream is not None:
+            await follow_change_stream(stream, narrative, concurrency)
+        else:
+            await poll_changes(narrative, concurrency, position, poll_interval)
+    finally:
+        if stream is not None:
+            stream.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["auto", "watch", "poll"], default="auto",
+                        help="watch: change stream, poll: UPDATED_AT_FIELD polling, auto: change stream if available")
+    parser.add_argument("--narrative", action="store_true", default=PRECOMPUTE_NARRATIVE,
+                        help="also precompute the ICMR narrative (calls the LLM)")
+    parser.add_argument("--concurrency", type=int, default=PRECOMPUTE_CONCURRENCY)
+    parser.add_argument("--poll-interval", type=float, default=PRECOMPUTE_POLL_INTERVAL, help="seconds between polls")
+    parser.add_argument("--once", action="store_true", help="backfill the catalogue and exit")
+    args = parser.parse_args()
+
+    logger.info("precompute_start mode=%s narrative=%s field=%s", args.mode, args.narrative, PRECOMPUTED_FIELD)
+
+    async def run():
+        try:
+            await run_worker(args.mode, args.narrative, args.concurrency, args.poll_interval, args.once)
+        finally:
+            await close_llm_client()
+            close_client()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
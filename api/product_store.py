@@ -0,0 +1,146 @@
+import os
+import asyncio
+import logging
+import threading
+from typing import List, Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# Product documents are read from MongoDB through one pooled client per process.
+# pymongo is imported on first use (see get_collection) to keep it out of cold starts.
+
+MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
+MONGODB_DATABASE = os.getenv("MONGODB_DATABASE", "consumeWise")
+MONGODB_COLLECTION = os.getenv("MONGODB_COLLECTION", "products")
+MONGODB_MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", 50))
+MONGODB_TIMEOUT_MS = int(os.getenv("MONGODB_TIMEOUT_MS", 5000))
+# Maximum number of ids per $in query
+MONGODB_IN_BATCH_SIZE = int(os.getenv("MONGODB_IN_BATCH_SIZE", 1000))
+
+# Materialized analysis written back by the precompute worker (see precompute.py)
+PRECOMPUTED_FIELD = os.getenv("PRECOMPUTED_FIELD", "nutrientAnalysis")
+# Timestamp the catalogue sets on every change, polled when change streams are not available
+UPDATED_AT_FIELD = os.getenv("UPDATED_AT_FIELD", "updatedAt")
+
+# Only the fields the analysis pipeline reads
+PRODUCT_PROJECTION = {
+    'servingSize': 1,
+    'nutritionalInformation': 1,
+    'brandName': 1,
+    'productName': 1,
+    'ingredients.name': 1,
+    'claims': 1,
+    PRECOMPUTED_FIELD: 1,
+}
+# The precompute worker also needs the change timestamp
+CHANGE_PROJECTION = dict(PRODUCT_PROJECTION, **{UPDATED_AT_FIELD: 1})
+
+_client = None
+_collection = None
+_lock = threading.Lock()
+
+
+def get_collection():
+    global _client, _collection
+    if _collection is None:
+        with _lock:
+            if _collection is None:
+                from pymongo import MongoClient
+                _client = MongoClient(
+                    MONGODB_URI,
+                    maxPoolSize=MONGODB_MAX_POOL_SIZE,
+                    serverSelectionTimeoutMS=MONGODB_TIMEOUT_MS,
+                    connectTimeoutMS=MONGODB_TIMEOUT_MS,
+                    appname="nutrient-analysis"
+                )
+                _collection = _client[MONGODB_DATABASE][MONGODB_COLLECTION]
+    return _collection
+
+
+def set_collection(collection):
+    """Use another collection, e.g. a mongomock collection in tests."""
+    global _collection
+    _collection = collection
+
+
+def close_client():
+    global _client, _collection
+    if _client is not None:
+        _client.close()
+    _client = None
+    _collection = None
+
+
+def to_object_id(product_id: str):
+    # Catalogue ids are ObjectIds, but keep other ids (e.g. from imports) as they are
+    from bson import ObjectId
+    return ObjectId(product_id) if ObjectId.is_valid(product_id) else product_id
+
+
+def find_product(product_id: str) -> Optional[Dict[str, Any]]:
+    return get_collection().find_one({'_id': to_object_id(product_id)}, PRODUCT_PROJECTION)
+
+
+def find_products(product_ids: List[str]) -> List[Optional[Dict[str, Any]]]:
+    """Look up many products with $in queries of up to MONGODB_IN_BATCH_SIZE ids. Returns them in the order of product_ids, None for unknown ids."""
+    ids = [to_object_id(product_id) for product_id in product_ids]
+    unique_ids = list(dict.fromkeys(ids))
+    found = {}
+    for start in range(0, len(unique_ids), MONGODB_IN_BATCH_SIZE):
+        chunk = unique_ids[start:start + MONGODB_IN_BATCH_SIZE]
+        for product in get_collection().find({'_id': {'$in': chunk}}, PRODUCT_PROJECTION):
+            found[str(product['_id'])] = product
+    return [found.get(str(product_id)) for product_id in ids]
+
+
+def save_precomputed(product_id, precomputed: Dict[str, Any]):
+    # Only the materialized field is written, the rest of the document is left to the catalogue
+    get_collection().update_one({'_id': product_id}, {'$set': {PRECOMPUTED_FIELD: precomputed}})
+
+
+def iter_all_products(batch_size: int = MONGODB_IN_BATCH_SIZE):
+    """All product documents, in _id order, fetched batch_size at a time."""
+    return get_collection().find({}, CHANGE_PROJECTION, batch_size=batch_size).sort('_id', 1)
+
+
+def find_products_updated_since(updated_at, last_id=None, limit: int = MONGODB_IN_BATCH_SIZE) -> List[Dict[str, Any]]:
+    """
+    Products changed at or after updated_at, in (updatedAt, _id) order. Pass the position of the last
+    product of the previous page as (updated_at, last_id) to page through products with the same timestamp.
+    """
+    if updated_at is None:
+        query = {UPDATED_AT_FIELD: {'$ne': None}}
+    elif last_id is None:
+        query = {UPDATED_AT_FIELD: {'$gte': updated_at}}
+    else:
+        query = {'$or': [{UPDATED_AT_FIELD: {'$gt': updated_at}}, {UPDATED_AT_FIELD: updated_at, '_id': {'$gt': last_id}}]}
+    cursor = get_collection().find(query, CHANGE_PROJECTION).sort([(UPDATED_AT_FIELD, 1), ('_id', 1)]).limit(limit)
+    return list(cursor)
+
+
+def watch_products(resume_after=None):
+    """
+    Change stream of inserted, updated and replaced products, with the current document attached.
+    Needs a replica set or sharded cluster; pymongo raises OperationFailure on a standalone server.
+    Updates that only touch PRECOMPUTED_FIELD (the worker's own writes) are filtered out on the server.
+    """
+    pipeline = [
+        {'$match': {
+            'operationType': {'$in': ['insert', 'update', 'replace']},
+            f'updateDescription.updatedFields.{PRECOMPUTED_FIELD}': {'$exists': False},
+        }},
+        {'$project': dict({'operationType': 1, 'documentKey': 1},
+                          **{f'fullDocument.{field}': 1 for field in CHANGE_PROJECTION})},
+    ]
+    return get_collection().watch(pipeline, full_document='updateLookup', resume_after=resume_after,
+                                  max_await_time_ms=1000)
+
+
+# pymongo is synchronous; run the queries in a worker thread so they don't block the event loop
+
+async def fetch_product(product_id: str) -> Optional[Dict[str, Any]]:
+    return await asyncio.to_thread(find_product, product_id)
+
+
+async def fetch_products(product_ids: List[str]) -> List[Optional[Dict[str, Any]]]:
+    return await asyncio.to_thread(find_products, product_ids)
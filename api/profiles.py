@@ -0,0 +1,93 @@
+import os
+import json
+import numpy as np
+from typing import List, Dict, Any, Sequence
+from fastapi import HTTPException
+
+from cache import canonical_hash
+from scoring import percentage_nutrients, threshold_nutrients, compile_table
+from rda import daily_values
+from nutrient_analyzer import thresholds, product_types
+
+# RDA / threshold profiles (age, sex, activity level) from a data file, compiled into dense arrays
+# at startup. The built-in tables (daily_values in rda.py, thresholds in nutrient_analyzer.py) are
+# the 'default' profile, and fill in whatever a profile of the data file leaves out.
+
+RDA_PROFILES_PATH = os.getenv("RDA_PROFILES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "rda_profiles.json"))
+DEFAULT_PROFILE = "default"
+
+
+def load_profiles(path: str = RDA_PROFILES_PATH) -> Dict[str, Dict[str, Any]]:
+    """{profile id: {'description', 'dailyValues', 'thresholds'}}, the default profile first."""
+    profiles = {
+        DEFAULT_PROFILE: {
+            'description': "General guidelines (2230 kcal)",
+            'dailyValues': dict(daily_values),
+            'thresholds': {product_type: dict(thresholds[product_type]) for product_type in product_types},
+        }
+    }
+    with open(path) as f:
+        data = json.load(f)
+
+    for profile in data['profiles']:
+        profile_id = profile['id']
+        if profile_id in profiles:
+            raise ValueError(f"Duplicate RDA profile: {profile_id}")
+        unknown = set(profile.get('dailyValues', {})) - set(daily_values)
+        unknown |= set(profile.get('thresholds', {})) - set(product_types)
+        for product_type_thresholds in profile.get('thresholds', {}).values():
+            unknown |= set(product_type_thresholds) - set(threshold_nutrients)
+        if unknown:
+            raise ValueError(f"Unknown entries in RDA profile {profile_id}: {sorted(unknown)}")
+
+        profiles[profile_id] = {
+            'description': profile.get('description', ""),
+            'dailyValues': dict(daily_values, **profile.get('dailyValues', {})),
+            'thresholds': {product_type: dict(thresholds[product_type], **profile.get('thresholds', {}).get(product_type, {}))
+                           for product_type in product_types},
+        }
+    return profiles
+
+
+profiles = load_profiles()
+profile_ids = list(profiles)
+profile_index = {profile_id: i for i, profile_id in enumerate(profile_ids)}
+
+# profiles x len(percentage_nutrients)
+daily_value_table = np.array([compile_table(profile['dailyValues'], percentage_nutrients) for profile in profiles.values()])
+# profiles x product types x len(threshold_nutrients)
+threshold_table = np.array([[compile_table(profile['thresholds'][product_type], threshold_nutrients) for product_type in product_types]
+                            for profile in profiles.values()])
+
+# Changes whenever the values of a profile change, for cache keys
+profile_versions = {profile_id: canonical_hash(daily_value_table[i].tolist(), threshold_table[i].tolist())
+                    for profile_id, i in profile_index.items()}
+
+
+def profile_positions(requested_profile_ids: Sequence[str]) -> np.ndarray:
+    for profile_id in requested_profile_ids:
+        if profile_id not in profile_index:
+            raise HTTPException(status_code=400, detail=f"Invalid profile: {profile_id}")
+    return np.array([profile_index[profile_id] for profile_id in requested_profile_ids], dtype=int)
+
+
+def daily_value_rows(requested_profile_ids: Sequence[str]) -> np.ndarray:
+    """len(requested_profile_ids) x len(percentage_nutrients) daily values, for process_nutrition_bulk."""
+    return daily_value_table[profile_positions(requested_profile_ids)]
+
+
+def threshold_rows(requested_profile_ids: Sequence[str], product_types_list: Sequence[str]) -> np.ndarray:
+    """
+    Threshold rows for analyze_nutrients_bulk, one per (profile, product type) pair.
+    Either list may have a single entry, it is then used for every entry of the other.
+    """
+    for product_type in product_types_list:
+        if product_type not in thresholds:
+            raise HTTPException(status_code=400, detail=f"Invalid product type: {product_type}")
+    type_positions = np.array([product_types.index(product_type) for product_type in product_types_list], dtype=int)
+    return threshold_table[profile_positions(requested_profile_ids), type_positions]
+
+
+def list_profiles() -> List[Dict[str, Any]]:
+    return [{'id': profile_id, 'description': profile['description'], 'dailyValues': profile['dailyValues'],
+             'thresholds': profile['thresholds']} for profile_id, profile in profiles.items()]
@@ -0,0 +1,141 @@
+import os
+import json
+import logging
+from typing import List, Dict, Any
+
+from nutrient_extractor import nutrient_name_list, unused_labels
+from metrics import llm_tokens
+
+logger = logging.getLogger(__name__)
+
+# Prompts and response schema of the two LLM calls, built once at import instead of on every call.
+# The system prompts are static and come first, so the provider's prompt caching can reuse them
+# across requests; everything that varies per product goes into one compact user message.
+
+# Bump these whenever a prompt changes so that cached results produced by the old prompt are not served
+EXTRACTION_PROMPT_VERSION = "2"
+ICMR_PROMPT_VERSION = "2"
+
+# Prompts longer than this (estimated input tokens) are logged as warnings
+LLM_PROMPT_TOKEN_BUDGET = int(os.getenv("LLM_PROMPT_TOKEN_BUDGET", 1500))
+
+EXTRACTION_NUTRIENTS = ', '.join(nutrient_name_list)
+
+EXTRACTION_SYSTEM_PROMPT = (
+    "You will be given nutritional information of a food product, one label entry per line as "
+    "\"name (unit): basis: value; basis: value\". "
+    f"Extract the values of the following nutrients: {EXTRACTION_NUTRIENTS}, and the servingSize they refer to. "
+    "Return the data in the exact JSON format specified in the schema, with all required fields."
+)
+
+NUTRITION_RESPONSE_FORMAT = {"type": "json_schema", "json_schema": {
+    "name": "Nutritional_Info_Label_Reader",
+    "schema": {
+        "type": "object",
+        "properties": {key: {"type": "number"} for key in nutrient_name_list + ["servingSize"]},
+        "required": nutrient_name_list + ["servingSize"],
+        "additionalProperties": False
+    },
+    "strict": True
+}}
+
+ICMR_SYSTEM_PROMPT = """Task: Analyze the nutritional content of the food item and compare it to the Recommended Daily Allowance (RDA) or threshold limits defined by ICMR. Provide practical, contextual insights.
+
+Input (JSON):
+- thresholds: % above (+) or below (-) the ICMR threshold per 100 g/ml, for calories, sugar and salt
+- rda: nutrition per serving as % of the RDA
+
+Nutrient breakdown and analysis:
+- Calories: compare the calorie content to a well-balanced meal; calculate how many meals' worth of calories the product contains.
+- Sugar & salt: convert the amounts into teaspoons; explain whether the levels exceed the ICMR-defined limits and what that means for overall health.
+- Fat & calories: say whether fat is high or low in relation to a balanced diet, and how the fat and calorie levels may impact the user's overall diet, including potential risks or benefits.
+
+Contextual insights: for each nutrient, explain how its level affects health and diet balance. Give actionable recommendations (healthier alternatives, adjusted consumption), tailored to the user's lifestyle, e.g. lower intake if sedentary.
+
+Output: for each nutrient (Calories, Sugar, Salt, Fat), whether it exceeds or is below the RDA or ICMR threshold, with clear, concise comparisons (e.g. sugar exceeds the RDA by 20%, equivalent to X teaspoons)."""
+
+_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """Tokens of text for gpt-4o (o200k_base) with tiktoken if it is installed, else estimated at ~4 characters per token."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            # Not installed, or the encoding can't be downloaded
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+def count_message_tokens(messages: List[Dict[str, str]]) -> int:
+    # Each message costs a few tokens of framing (role, separators), and the reply is primed with 3 more
+    return sum(count_tokens(message["content"]) + 3 for message in messages) + 3
+
+
+def compact_number(value, digits: int = 1):
+    """Round for the prompt: 84.8000000001 -> 84.8, 12.0 -> 12."""
+    rounded = round(float(value), digits)
+    return int(rounded) if rounded.is_integer() else rounded
+
+
+def compact_label(nutritional_information: List[Dict[str, Any]]) -> str:
+    """The label entries the extraction needs, one per line: "name (unit): basis: value; basis: value"."""
+    lines = []
+    for item in nutritional_information or []:
+        name = str(item.get('name', '')).strip()
+        # Label entries the extraction never needs (micronutrients etc.) are left out of the prompt
+        if any(unused in name.lower() for unused in unused_labels):
+            continue
+        values = []
+        for value in item.get('values') or []:
+            number = value.get('value')
+            number = compact_number(number, 3) if isinstance(number, (int, float)) else number
+            values.append(f"{value.get('base', '')}: {number}")
+        unit = item.get('unit')
+        lines.append(f"{name} ({unit}): {'; '.join(values)}" if unit else f"{name}: {'; '.join(values)}")
+    return "\n".join(lines)
+
+
+def build_extraction_messages(nutritional_information: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": EXTRACTION_SYSTEM_PROMPT},
+        {"role": "user", "content": compact_label(nutritional_information)},
+    ]
+
+
+def icmr_payload(nutrient_analysis: Dict[str, Any], nutrient_analysis_rda: Dict[str, Any]) -> str:
+    """
+    Canonical JSON of the threshold analysis (analyze_nutrients) and %RDA (find_nutrition), built from
+    their numbers: rounded, fixed key order, no whitespace.
+    """
+    payload = {'thresholds': {nutrient: compact_number(value) for nutrient, value in nutrient_analysis['percentageDiffs'].items()}}
+    percentages = nutrient_analysis_rda.get('percentages')
+    if percentages is not None:
+        payload['rda'] = {nutrient: compact_number(value) for nutrient, value in percentages.items()}
+    elif nutrient_analysis_rda.get('rda'):
+        # e.g. an error from find_nutrition, passed on as it is
+        payload['rda'] = nutrient_analysis_rda['rda']
+    return json.dumps(payload, separators=(',', ':'))
+
+
+def build_icmr_messages(nutrient_analysis: Dict[str, Any], nutrient_analysis_rda: Dict[str, Any]) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": ICMR_SYSTEM_PROMPT},
+        {"role": "user", "content": icmr_payload(nutrient_analysis, nutrient_analysis_rda)},
+    ]
+
+
+def check_prompt_budget(call: str, messages: List[Dict[str, str]]) -> int:
+    """Estimated input tokens of a call, recorded in the metrics; a warning if they exceed LLM_PROMPT_TOKEN_BUDGET."""
+    tokens = count_message_tokens(messages)
+    llm_tokens.observe(tokens, call=call, kind="estimated_prompt")
+    if tokens > LLM_PROMPT_TOKEN_BUDGET:
+        logger.warning("llm_prompt_over_budget call=%s tokens=%d budget=%d", call, tokens, LLM_PROMPT_TOKEN_BUDGET)
+    else:
+        logger.debug("llm_prompt call=%s tokens=%d", call, tokens)
+    return tokens
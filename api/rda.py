@@ -1,66 +1,96 @@
-import math, json
+import json
+import logging
+import numpy as np
+from scoring import (percentage_nutrients, compile_table, nutrition_rows, scale_nutrition_bulk,
+                     percentage_of_daily_values, process_nutrition_bulk, process_nutrition_scalar,
+                     scaled_nutrition_dicts, percentage_dict, percentage_dicts, present_values, format_percentage)
+
+logger = logging.getLogger(__name__)
+
+# Recommended daily values (based on general guidelines)
+daily_values = {
+    'energy': 2230,
+    'protein': 55,
+    'carbohydrates': 330,
+    'addedSugars': 30,
+    'dietaryFiber': 30,
+    'totalFat': 74,
+    'saturatedFat': 22,
+    'sodium': 2000,
+    'monounsaturatedFat': 25,
+    'polyunsaturatedFat': 25,
+    'transFat': 2
+}
+# daily_values ordered by percentage_nutrients
+daily_value_array = compile_table(daily_values, percentage_nutrients)
+daily_value_list = daily_value_array.tolist()
+
+# Start of the %RDA text returned by find_nutrition, followed by the percentages as JSON
+RDA_ANALYSIS_PREFIX = "Nutrition per serving as percentage of Recommended Dietary Allowance (RDA) is "
 
 # Function to scale nutrition values
 def scale_nutrition(nutrition_per_serving, user_serving_size):
-    scaling_factor = user_serving_size / nutrition_per_serving['servingSize']
-    return {
-        'energy': round(nutrition_per_serving['energy'] * scaling_factor, 2),
-        'protein': round(nutrition_per_serving['protein'] * scaling_factor, 2),
-        'carbohydrates': round(nutrition_per_serving['carbohydrates'] * scaling_factor, 2),
-        'addedSugars': round(nutrition_per_serving['addedSugars'] * scaling_factor, 2),
-        'dietaryFiber': round(nutrition_per_serving['dietaryFiber'] * scaling_factor, 2),
-        'totalFat': round(nutrition_per_serving['totalFat'] * scaling_factor, 2),
-        'saturatedFat': round(nutrition_per_serving['saturatedFat'] * scaling_factor, 2),
-        'monounsaturatedFat': round(nutrition_per_serving['monounsaturatedFat'] * scaling_factor, 2),
-        'polyunsaturatedFat': round(nutrition_per_serving['polyunsaturatedFat'] * scaling_factor, 2),
-        'transFat': round(nutrition_per_serving['transFat'] * scaling_factor, 2),
-        'sodium': round(nutrition_per_serving['sodium'] * scaling_factor, 2)
-    }
+    scaled = scale_nutrition_bulk(nutrition_rows([nutrition_per_serving]),
+                                  np.array([nutrition_per_serving['servingSize']], dtype=float),
+                                  np.array([user_serving_size], dtype=float))
+    return scaled_nutrition_dicts(scaled)[0]
 
 # Function to calculate percentage of daily value
 def calculate_percentage(nutrient_value, daily_value):
-    print(f"DEBUG : nutrient_value : {nutrient_value} daily_value : {daily_value}")
-    if daily_value == 0 or math.isnan(nutrient_value):
-        return 'N/A'
-    return f"{round((nutrient_value / daily_value) * 100, 2)}%"
+    logger.debug("calculate_percentage nutrient_value=%s daily_value=%s", nutrient_value, daily_value)
+    percentage = percentage_of_daily_values(np.array([nutrient_value], dtype=float), np.array([daily_value], dtype=float))
+    return format_percentage(percentage.tolist()[0])
+
+# Scale and calculate percentages for many products in one pass.
+# daily_value_rows (see profiles.py) is one row for all products, one row per product,
+# or one row per profile for a single product.
+def process_nutrition_data_bulk(nutrition_per_serving_list, user_serving_sizes, daily_value_rows=None):
+    if daily_value_rows is None:
+        daily_value_rows = daily_value_array
+    scaled, percentages = process_nutrition_bulk(nutrition_per_serving_list, user_serving_sizes, daily_value_rows)
+    scaled = np.broadcast_to(scaled, (percentages.shape[0], scaled.shape[1]))
+    return list(zip(scaled_nutrition_dicts(scaled), percentage_dicts(percentages)))
+
+# Scaled values and %RDA row (ordered by percentage_nutrients, NaN when missing) of one product
+def nutrition_percentages(nutrition_per_serving, user_serving_size, daily_value_row=None):
+    if daily_value_row is None:
+        daily_value_values = daily_value_list
+    elif np.ndim(daily_value_row) == 1:
+        daily_value_values = np.asarray(daily_value_row, dtype=float).tolist()
+    else:
+        daily_value_values = None
+    processed = process_nutrition_scalar(nutrition_per_serving, user_serving_size, daily_value_values) if daily_value_values else None
+    if processed is None:
+        if daily_value_row is None:
+            daily_value_row = daily_value_array
+        scaled, percentages = process_nutrition_bulk([nutrition_per_serving], [user_serving_size], daily_value_row)
+        return scaled_nutrition_dicts(scaled)[0], percentages.tolist()[0]
+    return processed
 
 # Main function to scale and calculate percentages (can be called directly in other parts of your code)
-def process_nutrition_data(nutrition_per_serving, user_serving_size):
-    # Recommended daily values (based on general guidelines)
-    daily_values = {
-        'energy': 2230,
-        'protein': 55,
-        'carbohydrates': 330,
-        'addedSugars': 30,
-        'dietaryFiber': 30,
-        'totalFat': 74,
-        'saturatedFat': 22,
-        'sodium': 2000,
-        'monounsaturatedFat': 25,
-        'polyunsaturatedFat': 25,
-        'transFat': 2
-    }
-
-    scaled_nutrition = scale_nutrition(nutrition_per_serving, user_serving_size)
+def process_nutrition_data(nutrition_per_serving, user_serving_size, daily_value_row=None):
+    scaled_nutrition, percentage_row = nutrition_percentages(nutrition_per_serving, user_serving_size, daily_value_row)
     #Example : scaled_nutrition : {'energy': 86.86, 'protein': 1.26, 'carbohydrates': 14.29, 'addedSugars': 5.06, 'dietaryFiber': 0.0, 
     #'totalFat': 2.74, 'saturatedFat': 1.28, 'monounsaturatedFat': 0.0, 'polyunsaturatedFat': 0.0, 'transFat': 0.0, 'sodium': 52.83}
+    return scaled_nutrition, percentage_dict(percentage_row)
+
+# %RDA text of find_nutrition, e.g. for percentages computed with process_nutrition_data_bulk
+def format_rda_analysis(percentage_daily_values):
+    return f"{RDA_ANALYSIS_PREFIX}{json.dumps(percentage_daily_values)}"
+
+# Result of find_nutrition: the %RDA text, and the percentages as numbers for the ICMR prompt (see prompts.icmr_payload).
+# percentages is None if there is no %RDA, e.g. for an error.
+def rda_result(percentage_row):
+    return {'rda': format_rda_analysis(percentage_dict(percentage_row)),
+            'percentages': present_values(percentage_nutrients, percentage_row)}
+
+def rda_error(rda_analysis_str):
+    return {'rda': rda_analysis_str, 'percentages': None}
 
-    percentage_daily_values = {
-        'energy': calculate_percentage(scaled_nutrition['energy'], daily_values['energy']),
-        'protein': calculate_percentage(scaled_nutrition['protein'], daily_values['protein']),
-        'carbohydrates': calculate_percentage(scaled_nutrition['carbohydrates'], daily_values['carbohydrates']),
-        'addedSugars': calculate_percentage(scaled_nutrition['addedSugars'], daily_values['addedSugars']),
-        'dietaryFiber': calculate_percentage(scaled_nutrition['dietaryFiber'], daily_values['dietaryFiber']),
-        'totalFat': calculate_percentage(scaled_nutrition['totalFat'], daily_values['totalFat']),
-        'saturatedFat': calculate_percentage(scaled_nutrition['saturatedFat'], daily_values['saturatedFat']),
-        'sodium': calculate_percentage(scaled_nutrition['sodium'], daily_values['sodium']),
-    }
-    return scaled_nutrition, percentage_daily_values
-
-async def find_nutrition(data):
+async def find_nutrition(data, daily_value_row=None):
     #data is a dict. See https://github.com/ConsumeWise123/rda1/blob/main/clientp.py
     if not data:
-        return ""
+        return rda_error("")
     try:
         nutrition_per_serving = data['nutritionPerServing']
         user_serving_size = 0
@@ -70,17 +100,16 @@ async def find_nutrition(data):
 
 
         if not nutrition_per_serving:
-            return json.dumps({"error": "Invalid nutrition data"})
+            return rda_error(json.dumps({"error": "Invalid nutrition data"}))
         elif user_serving_size <= 0:
-            return json.dumps({"error": "Invalid user serving size"})
+            return rda_error(json.dumps({"error": "Invalid user serving size"}))
 
         # Process and respond with scaled values and daily percentages
-        scaled_nutrition, percentage_daily_values = await process_nutrition_data(nutrition_per_serving, user_serving_size)
-        print(f"DEBUG : percentage_daily_values : {percentage_daily_values}")
+        scaled_nutrition, percentage_row = nutrition_percentages(nutrition_per_serving, user_serving_size, daily_value_row)
 
-        rda_analysis_str = f"Nutrition per serving as percentage of Recommended Dietary Allowance (RDA) is {json.dumps(percentage_daily_values)}"
-        print(f"DEBUG : rda_analysis_str : {rda_analysis_str}")
-        return rda_analysis_str
+        nutrient_analysis_rda = rda_result(percentage_row)
+        logger.debug("find_nutrition rda_analysis_str=%s", nutrient_analysis_rda['rda'])
+        return nutrient_analysis_rda
         
     except Exception as e:
-        return json.dumps({"error" : "Invalid JSON or input"})
+        return rda_error(json.dumps({"error" : "Invalid JSON or input"}))
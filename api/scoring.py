@@ -0,0 +1,189 @@
+import math
+import numpy as np
+from typing import List, Dict, Any, Optional, Sequence, Tuple
+
+from nutrient_extractor import nutrient_name_list
+
+# Columnar scoring engine: N products x nutrients held as float arrays, missing values as NaN.
+# nutrient_analyzer.py and rda.py wrap these functions for single products. Building arrays costs more
+# than the arithmetic for one product, so the wrappers use the scalar versions (*_scalar) instead;
+# they do the same float operations in the same order and give identical results (tests/test_scoring.py).
+
+# Nutrients compared against the ICMR thresholds (columns of the threshold arrays)
+threshold_nutrients = ['calories', 'sugar', 'salt']
+
+# Nutrients reported as percentage of daily value, in the order of percentage_daily_values
+percentage_nutrients = [
+    'energy', 'protein', 'carbohydrates', 'addedSugars', 'dietaryFiber',
+    'totalFat', 'saturatedFat', 'sodium'
+]
+percentage_columns = np.array([nutrient_name_list.index(key) for key in percentage_nutrients])
+
+
+# Types the scalar functions handle; anything else (None, strings, NumPy scalars) goes through the arrays
+numeric_types = (int, float)
+
+
+def compile_table(table: Dict[str, float], keys: Sequence[str]) -> np.ndarray:
+    """Turn a {nutrient: value} dict into an array ordered by keys (NaN for missing entries)."""
+    return np.array([table.get(key, np.nan) for key in keys], dtype=float)
+
+
+def to_column(values: Sequence[Optional[float]]) -> np.ndarray:
+    """Convert a sequence that may contain None into a float array with NaN."""
+    return np.array([np.nan if value is None else value for value in values], dtype=float)
+
+
+def round_values(values: np.ndarray, digits: int = 2) -> np.ndarray:
+    """
+    Vectorized round() that gives the same results as Python's round(value, digits).
+    np.round scales by 10**digits first, which moves values close to a tie to the wrong side;
+    those few values are rounded with round() instead.
+    """
+    scale = 10.0 ** digits
+    with np.errstate(invalid='ignore'):
+        scaled = values * scale
+        rounded = np.round(scaled) / scale
+        near_tie = np.abs(np.abs(scaled - np.trunc(scaled)) - 0.5) < 1e-6
+    if near_tie.any():
+        rounded[near_tie] = [round(value, digits) for value in values[near_tie].tolist()]
+    return rounded
+
+
+def score_thresholds(values: np.ndarray, serving_sizes: np.ndarray, thresholds: np.ndarray):
+    """
+    Scale per-serving values to per 100 g/ml and compare them to the thresholds.
+
+    Args:
+        values: N x len(threshold_nutrients) array of per-serving values, NaN when unknown
+        serving_sizes: N serving sizes
+        thresholds: N x len(threshold_nutrients) (or broadcastable) threshold array
+
+    Returns:
+        Tuple of (scaled values, difference from threshold, percentage difference) arrays
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scaled = values / serving_sizes[:, None] * 100
+        difference = scaled - thresholds
+        percentage_diff = difference / thresholds * 100
+    # Nothing can be scaled to 100 g/ml from a zero (or negative) serving size; report it like a missing value
+    invalid_serving = ~(serving_sizes > 0)
+    if invalid_serving.any():
+        scaled[invalid_serving] = difference[invalid_serving] = percentage_diff[invalid_serving] = np.nan
+    return scaled, difference, percentage_diff
+
+
+def score_thresholds_scalar(values: Sequence[Optional[float]], serving_size: float,
+                            thresholds: Sequence[float]) -> Optional[List[float]]:
+    """
+    Percentage differences of score_thresholds for one product (NaN for values that are None).
+    None if the inputs need the array version, e.g. a zero serving size or non-numeric values.
+    """
+    if type(serving_size) not in numeric_types or not serving_size > 0:
+        return None
+    serving_size = float(serving_size)
+    percentage_diff = []
+    for value, threshold in zip(values, thresholds):
+        if value is None:
+            percentage_diff.append(math.nan)
+            continue
+        if type(value) not in numeric_types or threshold == 0:
+            return None
+        scaled = float(value) / serving_size * 100
+        percentage_diff.append((scaled - threshold) / threshold * 100)
+    return percentage_diff
+
+
+def scale_nutrition_bulk(values: np.ndarray, label_serving_sizes: np.ndarray, user_serving_sizes: np.ndarray) -> np.ndarray:
+    """Scale N x len(nutrient_name_list) label values from the label serving size to the user serving size, rounded to 2 places."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scaling_factor = user_serving_sizes / label_serving_sizes
+        scaled = round_values(values * scaling_factor[:, None])
+    # A zero label serving size has no meaningful scaling; report it like a missing value
+    scaled[~np.isfinite(scaled)] = np.nan
+    return scaled
+
+
+def percentage_of_daily_values(scaled: np.ndarray, daily_values: np.ndarray) -> np.ndarray:
+    """Percentage of daily value, rounded to 2 places. NaN where the value is NaN or the daily value is 0."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percentages = round_values(scaled / daily_values * 100)
+    percentages[np.isnan(scaled) | (daily_values == 0) | np.isnan(daily_values)] = np.nan
+    return percentages
+
+
+def format_percentage(percentage: float) -> str:
+    return 'N/A' if math.isnan(percentage) else f"{percentage}%"
+
+
+def nutrition_rows(nutrition_per_serving_list: List[Dict[str, Any]]) -> np.ndarray:
+    """N x len(nutrient_name_list) array from 'nutritionPerServing' dicts."""
+    return np.array([[nutrition_per_serving[key] for key in nutrient_name_list]
+                     for nutrition_per_serving in nutrition_per_serving_list], dtype=float).reshape(-1, len(nutrient_name_list))
+
+
+def process_nutrition_bulk(nutrition_per_serving_list: List[Dict[str, Any]], user_serving_sizes: Sequence[float],
+                           daily_values: np.ndarray):
+    """
+    Scale N products to their user serving sizes and compute %RDA in one pass.
+
+    Args:
+        nutrition_per_serving_list: 'nutritionPerServing' dicts (as returned by rda_analysis)
+        user_serving_sizes: user serving size of each product
+        daily_values: daily values ordered by percentage_nutrients, shape (K,) or (N, K)
+
+    Returns:
+        Tuple of the N x len(nutrient_name_list) scaled array and the N x K percentage array
+    """
+    values = nutrition_rows(nutrition_per_serving_list)
+    label_serving_sizes = np.array([nutrition_per_serving['servingSize'] for nutrition_per_serving in nutrition_per_serving_list], dtype=float)
+    scaled = scale_nutrition_bulk(values, label_serving_sizes, np.asarray(user_serving_sizes, dtype=float))
+    percentages = percentage_of_daily_values(scaled[:, percentage_columns], daily_values)
+    return scaled, percentages
+
+
+def process_nutrition_scalar(nutrition_per_serving: Dict[str, Any], user_serving_size: float,
+                             daily_values: Sequence[float]) -> Optional[Tuple[Dict[str, float], List[float]]]:
+    """
+    process_nutrition_bulk for one product: the scaled values like scaled_nutrition_dicts, and the
+    percentage row (NaN when missing).
+    None if the inputs need the array version, e.g. a zero label serving size or non-numeric values.
+    """
+    label_serving_size = nutrition_per_serving['servingSize']
+    if (type(label_serving_size) not in numeric_types or label_serving_size == 0
+            or type(user_serving_size) not in numeric_types):
+        return None
+    scaling_factor = float(user_serving_size) / float(label_serving_size)
+    scaled_nutrition = {}
+    for key in nutrient_name_list:
+        value = nutrition_per_serving[key]
+        if type(value) not in numeric_types:
+            return None
+        value = round(value * scaling_factor, 2)
+        scaled_nutrition[key] = value if math.isfinite(value) else math.nan
+
+    percentage_row = []
+    for key, daily_value in zip(percentage_nutrients, daily_values):
+        value = scaled_nutrition[key]
+        if math.isnan(value) or daily_value == 0 or math.isnan(daily_value):
+            percentage_row.append(math.nan)
+        else:
+            percentage_row.append(round(value / daily_value * 100, 2))
+    return scaled_nutrition, percentage_row
+
+
+def scaled_nutrition_dicts(scaled: np.ndarray) -> List[Dict[str, float]]:
+    return [dict(zip(nutrient_name_list, row)) for row in scaled.tolist()]
+
+
+def percentage_dict(percentage_row: Sequence[float]) -> Dict[str, str]:
+    return {key: format_percentage(value) for key, value in zip(percentage_nutrients, percentage_row)}
+
+
+def percentage_dicts(percentages: np.ndarray) -> List[Dict[str, str]]:
+    return [percentage_dict(row) for row in percentages.tolist()]
+
+
+def present_values(keys: Sequence[str], row: Sequence[float]) -> Dict[str, float]:
+    """{key: value} of a row, without the missing (NaN) and infinite values."""
+    return {key: value for key, value in zip(keys, row) if math.isfinite(value)}
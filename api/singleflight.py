@@ -0,0 +1,68 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+from metrics import Counter
+
+coalesced_requests = Counter("nutrient_analysis_coalesced_requests_total",
+                             "Requests that joined an identical in-flight execution instead of running their own", ["flight"])
+flight_executions = Counter("nutrient_analysis_flight_executions_total",
+                            "Executions started by the single-flight groups", ["flight"])
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls with the same key into one execution whose result (or exception)
+    is shared by all callers.
+
+    The execution runs in its own task: a caller that is cancelled (e.g. its client disconnected)
+    stops waiting without affecting the others, and the execution is only cancelled once no
+    caller is waiting for it any more.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[str, _Call] = {}
+        self.stats = {'executions': 0, 'coalesced': 0}
+
+    def _finished(self, key, call, task):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved; the waiters (if any) get it from the shield
+            task.exception()
+
+    async def do(self, key: str, function: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(function()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda task: self._finished(key, call, task))
+            self.stats['executions'] += 1
+            flight_executions.inc(flight=self.name)
+        else:
+            self.stats['coalesced'] += 1
+            coalesced_requests.inc(flight=self.name)
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.task.done():
+                # Last one waiting: nobody needs the result any more, and new callers must not join it
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def __len__(self):
+        return len(self._calls)
@@ -0,0 +1,262 @@
+"""
+Bulk scoring of products to CSV / Excel spreadsheets.
+
+Rows are streamed in chunks of SPREADSHEET_CHUNK_SIZE through the columnar scoring functions, so
+memory stays constant however many products there are. Only the local analysis runs (threshold
+analysis, per-serving values and %RDA), labels the rules can't resolve are reported in the 'error'
+column instead of calling the LLM.
+
+    pip install -r requirements-worker.txt                    # openpyxl, for .xlsx files
+    python api/spreadsheets.py export catalogue.xlsx          # every product in MongoDB
+    python api/spreadsheets.py score labels.csv scores.xlsx   # label data from a spreadsheet
+
+Label spreadsheets have one product per row: the columns of label_meta_columns, and one column per
+nutrient named like the label, with the unit in brackets, e.g. "Energy (kcal)", "Added Sugars (g)",
+"Sodium (mg)". Values are per 100 g/ml unless the 'basis' column says otherwise (e.g. "per serving").
+"""
+import os
+import re
+import io
+import csv
+import sys
+import argparse
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from app import score_documents
+from nutrient_extractor import nutrient_name_list
+from profiles import DEFAULT_PROFILE, profile_index
+from scoring import percentage_nutrients
+
+# Products scored per call of the bulk scoring functions
+SPREADSHEET_CHUNK_SIZE = int(os.getenv("SPREADSHEET_CHUNK_SIZE", 1000))
+
+spreadsheet_formats = ['csv', 'xlsx']
+
+# Columns of a label spreadsheet that are not nutrients
+label_meta_columns = ['id', 'productName', 'brandName', 'servingSize', 'servingUnit', 'basis']
+
+output_columns = (['id', 'productName', 'brandName', 'productType', 'servingSize', 'servingUnit',
+                   'calories', 'sugar', 'salt', 'analysis']
+                  + [f"{key} (per serving)" for key in nutrient_name_list]
+                  + [f"{key} (% RDA)" for key in percentage_nutrients]
+                  + ['error'])
+
+header_pattern = re.compile(r'^(.*?)\s*\(([^)]*)\)\s*$')
+
+
+def spreadsheet_format(path: str) -> str:
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    if extension not in spreadsheet_formats:
+        raise ValueError(f"Unsupported spreadsheet format: {path} (expected .csv or .xlsx)")
+    return extension
+
+
+def chunks(items: Iterable[Any], chunk_size: int = SPREADSHEET_CHUNK_SIZE) -> Iterator[List[Any]]:
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def parse_number(value) -> Optional[float]:
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value.strip().replace(',', ''))
+    except ValueError:
+        raise ValueError(f"not a number: {value!r}")
+
+
+def label_row_to_product(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Turn a row of a label spreadsheet into a product document like the ones in MongoDB."""
+    serving_unit = str(row.get('servingUnit') or 'g').strip()
+    basis = str(row.get('basis') or f"per 100 {serving_unit}")
+    nutritional_information = []
+    for header, value in row.items():
+        if not header or header in label_meta_columns:
+            continue
+        try:
+            value = parse_number(value)
+        except ValueError as e:
+            raise ValueError(f"{header}: {e}")
+        if value is None:
+            continue
+        match = header_pattern.match(header)
+        name, unit = (match.group(1), match.group(2)) if match else (header, '')
+        nutritional_information.append({'name': name, 'unit': unit, 'values': [{'base': basis, 'value': value}]})
+    return {
+        '_id': row.get('id') or '',
+        'productName': row.get('productName'),
+        'brandName': row.get('brandName'),
+        'servingSize': {'quantity': parse_number(row.get('servingSize')), 'unit': serving_unit},
+        'nutritionalInformation': nutritional_information,
+    }
+
+
+def score_chunk(items: List[Any], to_product: Callable[[Any], Dict[str, Any]] = None,
+                profile_id: str = DEFAULT_PROFILE) -> List[Dict[str, Any]]:
+    """
+    Score a chunk of products with one call of each bulk scoring function (score_documents in app.py).
+
+    Args:
+        items: product documents, or rows that to_product turns into product documents
+        to_product: optional conversion of each item
+        profile_id: RDA / threshold profile (see profiles.py) all products are scored against
+
+    Returns:
+        One dict per item, keyed by output_columns; a malformed item only fills the 'error' column of its row
+    """
+    rows, scored_rows, products = [], [], []
+    for item in items:
+        row = dict.fromkeys(output_columns)
+        rows.append(row)
+        if to_product is None:
+            row['id'] = str(item.get('_id', ''))
+        else:
+            row['id'] = str(item.get('id') or '')
+        try:
+            product = item if to_product is None else to_product(item)
+            row['productName'] = product.get('productName')
+            row['brandName'] = product.get('brandName')
+            row['servingUnit'] = product['servingSize'].get('unit')
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            row['error'] = f"invalid product: {e}"
+            continue
+        scored_rows.append(row)
+        products.append(product)
+
+    for row, score in zip(scored_rows, score_documents(products, profile_id)):
+        if score['nutrients'] is not None:
+            product_type, calories, sugar, salt, serving_size = score['nutrients']
+            row.update(productType=product_type, servingSize=serving_size, calories=calories, sugar=sugar, salt=salt)
+        if score['error'] is not None:
+            row['error'] = f"invalid product: {score['error']}"
+            continue
+        if score['analysis'] is None:
+            row['error'] = "unknown serving unit or invalid serving size"
+            continue
+        row['analysis'] = score['analysis']['analysis']
+        if score['scaled'] is None:
+            row['error'] = "label could not be resolved: " + "; ".join(score['unresolved'])
+            continue
+        for key, value in zip(nutrient_name_list, score['scaled']):
+            row[f"{key} (per serving)"] = value
+        for key, value in zip(percentage_nutrients, score['percentages']):
+            row[f"{key} (% RDA)"] = value
+    return rows
+
+
+def cell(value):
+    # Empty cell for missing values (None, NaN)
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    return value
+
+
+def iter_scored_rows(items: Iterable[Any], to_product=None, chunk_size: int = SPREADSHEET_CHUNK_SIZE,
+                     profile_id: str = DEFAULT_PROFILE) -> Iterator[List[Any]]:
+    """Scored rows as lists ordered by output_columns, computed chunk_size items at a time."""
+    for chunk in chunks(items, chunk_size):
+        for row in score_chunk(chunk, to_product, profile_id):
+            yield [cell(row[column]) for column in output_columns]
+
+
+def iter_csv(rows: Iterable[List[Any]], chunk_size: int = SPREADSHEET_CHUNK_SIZE) -> Iterator[str]:
+    """CSV text (header included), one piece per chunk of rows."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(output_columns)
+    for chunk in chunks(rows, chunk_size):
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def write_spreadsheet(rows: Iterable[List[Any]], path: str, file_format: str = None):
+    file_format = file_format or spreadsheet_format(path)
+    if file_format == 'csv':
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            for text in iter_csv(rows):
+                f.write(text)
+        return
+
+    # Write-only workbooks stream the rows to disk instead of keeping them in memory
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet("nutrient analysis")
+    worksheet.append(output_columns)
+    for row in rows:
+        worksheet.append(row)
+    workbook.save(path)
+
+
+def read_label_rows(path: str, file_format: str = None) -> Iterator[Dict[str, Any]]:
+    """Rows of a label spreadsheet as {header: value} dicts, read lazily."""
+    file_format = file_format or spreadsheet_format(path)
+    if file_format == 'csv':
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            for row in csv.DictReader(f):
+                if any(value not in (None, '') for value in row.values()):
+                    yield row
+        return
+
+    from openpyxl import load_workbook
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        headers = [str(header).strip() if header is not None else None for header in next(rows, ())]
+        for values in rows:
+            if any(value not in (None, '') for value in values):
+                yield dict(zip(headers, values))
+    finally:
+        workbook.close()
+
+
+def iter_catalogue_rows(chunk_size: int = SPREADSHEET_CHUNK_SIZE, profile_id: str = DEFAULT_PROFILE) -> Iterator[List[Any]]:
+    """Scored rows of every product in MongoDB."""
+    from product_store import iter_all_products
+    cursor = iter_all_products(chunk_size)
+    try:
+        yield from iter_scored_rows(cursor, chunk_size=chunk_size, profile_id=profile_id)
+    finally:
+        cursor.close()
+
+
+def iter_label_rows(path: str, file_format: str = None, chunk_size: int = SPREADSHEET_CHUNK_SIZE,
+                    profile_id: str = DEFAULT_PROFILE) -> Iterator[List[Any]]:
+    """Scored rows of a label spreadsheet."""
+    return iter_scored_rows(read_label_rows(path, file_format), label_row_to_product, chunk_size, profile_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunk-size", type=int, default=SPREADSHEET_CHUNK_SIZE, help="products scored at a time")
+    parser.add_argument("--profile", choices=list(profile_index), default=DEFAULT_PROFILE, help="RDA / threshold profile")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="score every product in MongoDB")
+    export_parser.add_argument("output", help="output .csv or .xlsx file")
+    score_parser = commands.add_parser("score", help="score a spreadsheet of label data")
+    score_parser.add_argument("input", help="input .csv or .xlsx file")
+    score_parser.add_argument("output", help="output .csv or .xlsx file")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "export":
+            rows = iter_catalogue_rows(args.chunk_size, args.profile)
+        else:
+            rows = iter_label_rows(args.input, chunk_size=args.chunk_size, profile_id=args.profile)
+        write_spreadsheet(rows, args.output)
+    except ValueError as e:
+        sys.exit(str(e))
+
+
+if __name__ == "__main__":
+    main()
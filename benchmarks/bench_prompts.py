@@ -0,0 +1,132 @@
+"""
+Prompt size benchmark: input tokens and latency of the two LLM calls with the version 1 prompts
+(fixtures/prompts_v1.json: full json.dumps of the label, prose analysis with unrounded floats)
+against the current compact prompts in api/prompts.py, for the products in fixtures/products.json.
+
+Tokens are counted with tiktoken (o200k_base) when it is installed, otherwise estimated at ~4
+characters per token. Call latency is modelled by FakeAsyncOpenAI as a fixed latency plus a cost
+per prompt token (prefill).
+
+    python benchmarks/bench_prompts.py --llm-latency 0.2 --prompt-token-latency 0.0002
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import statistics
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(BENCH_DIR, "fixtures")
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "api"))
+sys.path.insert(0, BENCH_DIR)
+
+os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+
+from fake_openai import FakeAsyncOpenAI  # noqa: E402
+from bench_service import load_products, disable_result_cache, time_call  # noqa: E402
+
+
+def load_v1_prompts(path=os.path.join(FIXTURES_DIR, "prompts_v1.json")):
+    with open(path) as f:
+        return json.load(f)
+
+
+def v1_extraction_messages(v1, nutritional_information):
+    from prompts import EXTRACTION_NUTRIENTS
+    user_prompt = v1["extraction_user_prompt"].format(nutritional_information=json.dumps(nutritional_information),
+                                                      nutrients=EXTRACTION_NUTRIENTS)
+    return [{"role": "system", "content": v1["extraction_system_prompt"]}, {"role": "user", "content": user_prompt}]
+
+
+def v1_icmr_messages(v1, nutrient_analysis, nutrient_analysis_rda):
+    # The original prompt got the analysis dict without the numbers and the %RDA text
+    user_prompt = v1["icmr_user_prompt"].format(nutrient_analysis={"analysis": nutrient_analysis["analysis"]},
+                                                nutrient_analysis_rda=nutrient_analysis_rda["rda"])
+    return [{"role": "system", "content": v1["icmr_system_prompt"]}, {"role": "user", "content": user_prompt}]
+
+
+async def prepare_all(app, products):
+    return [await app.prepare_nutrient_analysis(product) for product in products]
+
+
+def build_variants(products, prepared):
+    """{(call, variant): (builder, [arguments per product])}"""
+    from prompts import build_extraction_messages, build_icmr_messages
+    v1 = load_v1_prompts()
+    labels = [(product["nutritionalInformation"],) for product in products]
+    analyses = [pair for pair in prepared if pair is not None]
+    return {
+        ("rda_analysis", "v1"): (lambda *args: v1_extraction_messages(v1, *args), labels),
+        ("rda_analysis", "compact"): (build_extraction_messages, labels),
+        ("analyze_nutrition_icmr_rda", "v1"): (lambda *args: v1_icmr_messages(v1, *args), analyses),
+        ("analyze_nutrition_icmr_rda", "compact"): (build_icmr_messages, analyses),
+    }
+
+
+async def time_calls(message_lists, response_format, args):
+    import llm_client
+    from prompts import count_message_tokens, NUTRITION_RESPONSE_FORMAT
+    fake = FakeAsyncOpenAI.from_file(os.path.join(FIXTURES_DIR, "llm_responses.json"), latency=args.llm_latency,
+                                     prompt_token_latency=args.prompt_token_latency, count_tokens=count_message_tokens)
+    llm_client.set_client(fake)
+    kwargs = {"response_format": NUTRITION_RESPONSE_FORMAT} if response_format else {}
+    latencies = []
+    for messages in message_lists:
+        start = time.perf_counter()
+        await llm_client.create_chat_completion(call="bench_prompts", model="gpt-4o", messages=messages, **kwargs)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="fixed latency of each fake LLM call in seconds")
+    parser.add_argument("--prompt-token-latency", type=float, default=0.0002, help="added latency per prompt token in seconds")
+    parser.add_argument("--repeat", type=int, default=2000, help="runs when timing the prompt builders")
+    args = parser.parse_args()
+
+    import app
+    import llm_client
+    import prompts
+
+    logging.getLogger("nutrient_analysis").setLevel(logging.WARNING)
+    disable_result_cache(app)
+    products = load_products()
+    # Products the rules can't resolve need the (fake) extraction call to get their analysis
+    llm_client.set_client(FakeAsyncOpenAI.from_file(os.path.join(FIXTURES_DIR, "llm_responses.json"), latency=0))
+    prepared = asyncio.run(prepare_all(app, products))
+
+    prompts.count_tokens("")
+    counter = "tiktoken o200k_base" if prompts._encoding else "estimate (~4 characters per token, tiktoken not installed)"
+    print(f"\nPrompt tokens per call ({len(products)} products, counted with {counter})")
+    print(f"{'call':<28} {'prompt':<8} {'system':>7} {'user':>7} {'total':>7} {'bytes':>7} {'build us':>9} {'latency ms':>11}")
+
+    totals = {}
+    for (call, variant), (builder, arguments) in build_variants(products, prepared).items():
+        message_lists = [builder(*argument) for argument in arguments]
+        system_tokens = statistics.mean(prompts.count_tokens(messages[0]["content"]) for messages in message_lists)
+        user_tokens = statistics.mean(prompts.count_tokens(messages[1]["content"]) for messages in message_lists)
+        total_tokens = statistics.mean(prompts.count_message_tokens(messages) for messages in message_lists)
+        size = statistics.mean(llm_client.request_size(messages) for messages in message_lists)
+        build = statistics.median(time_call(lambda: [builder(*argument) for argument in arguments], args.repeat)) / len(arguments)
+        latency = statistics.median(asyncio.run(time_calls(message_lists, call == "rda_analysis", args)))
+        totals[call, variant] = total_tokens
+        print(f"{call:<28} {variant:<8} {system_tokens:>7.0f} {user_tokens:>7.0f} {total_tokens:>7.0f} {size:>7.0f} "
+              f"{build * 1e6:>9.1f} {latency * 1000:>11.1f}")
+
+        # The system prompt must be byte-identical across products for the provider's prompt cache
+        prefixes = {messages[0]["content"] for messages in message_lists}
+        if len(prefixes) != 1:
+            print(f"{'':<28} {variant:<8} system prompt differs between products")
+
+    print()
+    for call in ("rda_analysis", "analyze_nutrition_icmr_rda"):
+        before, after = totals[call, "v1"], totals[call, "compact"]
+        print(f"{call}: {before:.0f} -> {after:.0f} prompt tokens per call ({(1 - after / before) * 100:.0f}% fewer)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+Offline benchmark of the nutrient analysis service.
+
+Replays the product corpus in fixtures/products.json against nutrient_analysis, with the OpenAI
+calls served by FakeAsyncOpenAI from the recorded responses in fixtures/llm_responses.json,
+and micro-benchmarks the local scoring functions.
+
+    python benchmarks/bench_service.py --concurrency 1,8,32 --requests 200 --llm-latency 0.5
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import statistics
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(BENCH_DIR, "fixtures")
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "api"))
+sys.path.insert(0, BENCH_DIR)
+
+os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+# Don't let the process-wide limit hide the effect of the benchmark's concurrency levels
+os.environ.setdefault("LLM_CONCURRENCY", "1024")
+
+from fake_openai import FakeAsyncOpenAI  # noqa: E402
+
+
+def load_products(path=os.path.join(FIXTURES_DIR, "products.json")):
+    with open(path) as f:
+        return json.load(f)
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return float("nan")
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "rps": len(latencies) / elapsed if elapsed else float("nan"),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+async def replay(app, products, total_requests, concurrency):
+    """Send total_requests analyses (cycling through products) with at most `concurrency` in flight."""
+    latencies = []
+    errors = 0
+    queue = asyncio.Queue()
+    for i in range(total_requests):
+        queue.put_nowait(products[i % len(products)])
+
+    async def worker():
+        nonlocal errors
+        while True:
+            try:
+                product = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            start = time.perf_counter()
+            try:
+                await app.nutrient_analysis(product)
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result = summarize(latencies, time.perf_counter() - start)
+    result["errors"] = errors
+    return result
+
+
+class NoFlight:
+    """Stands in for a SingleFlight group: every call runs its own execution, nothing is coalesced."""
+
+    def __init__(self, name):
+        self.name = name
+        self.stats = {'executions': 0, 'coalesced': 0}
+
+    async def do(self, key, function):
+        self.stats['executions'] += 1
+        return await function()
+
+    def __len__(self):
+        return 0
+
+
+def disable_result_cache(app):
+    from cache import LRUCache, ResultCache
+    # An LRU with no room evicts every entry immediately. Concurrent identical requests still share
+    # one execution through the single-flight groups, see reset_flights
+    app.result_cache = ResultCache(LRUCache(max_entries=0))
+
+
+def reset_flights(app, coalesce):
+    """Fresh single-flight groups (so their stats count one run), or with coalesce=False none at all."""
+    from singleflight import SingleFlight
+    flight = SingleFlight if coalesce else NoFlight
+    app.extraction_flights = flight("extraction")
+    app.analysis_flights = flight("analysis")
+
+
+def coalesced_calls(app):
+    return app.extraction_flights.stats['coalesced'] + app.analysis_flights.stats['coalesced']
+
+
+def run_service_benchmark(args):
+    import app
+    import llm_client
+
+    # Per-request info logs (e.g. LLM extraction fallbacks) would dominate the output
+    logging.getLogger("nutrient_analysis").setLevel(logging.WARNING)
+    products = load_products()
+    # Without the cache every request runs the full pipeline: identical concurrent requests are not
+    # coalesced either, otherwise the cycled corpus would make fewer LLM calls at higher concurrency
+    mode = "cache and coalescing on" if args.cache else "cache and coalescing off, every request runs the full pipeline"
+    print(f"\nEnd-to-end nutrient_analysis ({len(products)} products, LLM latency {args.llm_latency * 1000:.0f} ms, {mode})")
+    print(f"{'concurrency':>11} {'requests':>8} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>6} "
+          f"{'LLM calls':>9} {'coalesced':>9}")
+    for concurrency in args.concurrency:
+        fake = FakeAsyncOpenAI.from_file(os.path.join(FIXTURES_DIR, "llm_responses.json"),
+                                         latency=args.llm_latency, token_latency=args.token_latency)
+        llm_client.set_client(fake)
+        if not args.cache:
+            disable_result_cache(app)
+        reset_flights(app, coalesce=args.cache)
+        result = asyncio.run(replay(app, products, args.requests, concurrency))
+        print(f"{concurrency:>11} {result['requests']:>8} {result['rps']:>9.1f} {result['p50_ms']:>9.1f} "
+              f"{result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f} {result['errors']:>6} {fake.calls:>9} "
+              f"{coalesced_calls(app):>9}")
+
+
+def time_call(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def run_micro_benchmarks(args):
+    from app import find_product_nutrients
+    from nutrient_analyzer import analyze_nutrients, analyze_nutrients_bulk
+    from nutrient_extractor import extract_nutrition_per_serving
+    from rda import process_nutrition_data, process_nutrition_data_bulk
+
+    products = [product for product in load_products()
+                if extract_nutrition_per_serving(product["nutritionalInformation"], product["servingSize"]["quantity"])[0]]
+    found = [find_product_nutrients(product) for product in products]
+    nutrition = [extract_nutrition_per_serving(product["nutritionalInformation"], product["servingSize"]["quantity"])[0]
+                 for product in products]
+    serving_sizes = [product["servingSize"]["quantity"] for product in products]
+
+    def run_analyze_nutrients():
+        for product_type, calories, sugar, salt, serving_size in found:
+            # analyze_nutrients is a coroutine without awaits; drive it without an event loop
+            try:
+                analyze_nutrients(product_type, calories, sugar, salt, serving_size).send(None)
+            except StopIteration:
+                pass
+
+    benchmarks = [
+        ("find_product_nutrients", lambda: [find_product_nutrients(product) for product in products]),
+        ("extract_nutrition_per_serving", lambda: [extract_nutrition_per_serving(product["nutritionalInformation"], size)
+                                                   for product, size in zip(products, serving_sizes)]),
+        ("analyze_nutrients", run_analyze_nutrients),
+        ("analyze_nutrients_bulk", lambda: analyze_nutrients_bulk(*map(list, zip(*found)))),
+        ("process_nutrition_data", lambda: [process_nutrition_data(n, size) for n, size in zip(nutrition, serving_sizes)]),
+        ("process_nutrition_data_bulk", lambda: process_nutrition_data_bulk(nutrition, serving_sizes)),
+    ]
+
+    print(f"\nLocal functions (per product, {len(products)} products x {args.repeat} runs)")
+    print(f"{'function':<30} {'median us':>10} {'p95 us':>10}")
+    for name, function in benchmarks:
+        timings = sorted(t / len(products) for t in time_call(function, args.repeat))
+        print(f"{name:<30} {statistics.median(timings) * 1e6:>10.1f} {percentile(timings, 95) * 1e6:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=lambda s: [int(c) for c in s.split(",")], default=[1, 8, 32],
+                        help="comma separated concurrency levels (default 1,8,32)")
+    parser.add_argument("--requests", type=int, default=200, help="requests per concurrency level")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="latency of each fake LLM call in seconds")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="delay between streamed tokens in seconds")
+    parser.add_argument("--cache", action="store_true", help="keep the result cache and request coalescing enabled")
+    parser.add_argument("--repeat", type=int, default=2000, help="runs per micro-benchmark")
+    parser.add_argument("--micro-only", action="store_true", help="only run the micro-benchmarks")
+    args = parser.parse_args()
+
+    if not args.micro_only:
+        run_service_benchmark(args)
+    run_micro_benchmarks(args)
+
+
+if __name__ == "__main__":
+    main()
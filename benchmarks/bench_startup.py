@@ -0,0 +1,85 @@
+"""
+Cold-start benchmark: import time of the serverless entry point (api/app.py).
+
+Runs `python -X importtime -c "import app"` in fresh interpreters and reports the wall time of the
+import, the slowest modules by cumulative import time, and the first-request cost of the lazily
+loaded OpenAI client. The versions of the packages on the import path are printed with the
+results; requirements.txt pins the versions the published numbers were measured with.
+
+    python benchmarks/bench_startup.py --runs 5 --top 20
+"""
+import os
+import sys
+import argparse
+import statistics
+import platform
+import subprocess
+from collections import defaultdict
+from importlib import metadata
+
+API_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+# Packages whose import time makes up most of the cold start
+startup_packages = ["fastapi", "starlette", "pydantic", "numpy"]
+
+IMPORT_APP = "import time; start = time.perf_counter(); import app; print(f'WALL {time.perf_counter() - start}')"
+FIRST_CLIENT = ("import time, app, llm_client; start = time.perf_counter(); llm_client.get_client(); "
+                "print(f'WALL {time.perf_counter() - start}')")
+
+
+def run_python(code, importtime=False):
+    env = dict(os.environ, OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "startup-benchmark"))
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", code]
+    result = subprocess.run(command, cwd=API_DIR, env=env, capture_output=True, text=True, check=True)
+    wall = float(next(line for line in result.stdout.splitlines() if line.startswith("WALL")).split()[1])
+    return wall, result.stderr
+
+
+def parse_importtime(stderr):
+    """{module: (self us, cumulative us)} from -X importtime output."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters to start")
+    parser.add_argument("--top", type=int, default=20, help="number of modules to list")
+    args = parser.parse_args()
+
+    walls = []
+    per_module = defaultdict(list)
+    for _ in range(args.runs):
+        wall, stderr = run_python(IMPORT_APP, importtime=True)
+        walls.append(wall)
+        for name, (self_us, cumulative_us) in parse_importtime(stderr).items():
+            per_module[name].append((self_us, cumulative_us))
+
+    versions = ", ".join(f"{name} {metadata.version(name)}" for name in startup_packages)
+    print(f"Python {platform.python_version()}, {versions}")
+    print(f"import app: median {statistics.median(walls) * 1000:.1f} ms, "
+          f"min {min(walls) * 1000:.1f} ms, max {max(walls) * 1000:.1f} ms over {args.runs} runs (with -X importtime)")
+
+    rows = []
+    for name, timings in per_module.items():
+        rows.append((statistics.median(t[1] for t in timings), statistics.median(t[0] for t in timings), name))
+    rows.sort(reverse=True)
+    print(f"\n{'module':<50} {'cumulative ms':>14} {'self ms':>9}")
+    for cumulative_us, self_us, name in rows[:args.top]:
+        print(f"{name:<50} {cumulative_us / 1000:>14.1f} {self_us / 1000:>9.1f}")
+
+    lazy = [name for name in ("openai", "httpx", "sentence_transformers", "torch", "pymongo", "openpyxl")
+            if name in per_module]
+    print(f"\nHeavy dependencies imported at startup: {', '.join(lazy) if lazy else 'none'}")
+
+    first_client = [run_python(FIRST_CLIENT)[0] for _ in range(args.runs)]
+    print(f"First use of the OpenAI client (lazy import + pool): median {statistics.median(first_client) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import json
+import asyncio
+import itertools
+from types import SimpleNamespace
+
+
+class FakeStream:
+    """Async iterator over chat completion chunks, mimicking openai.AsyncStream."""
+
+    def __init__(self, content, usage, token_latency):
+        self._pieces = content.split(" ")
+        self._usage = usage
+        self._token_latency = token_latency
+
+    async def __aiter__(self):
+        for i, piece in enumerate(self._pieces):
+            if self._token_latency:
+                await asyncio.sleep(self._token_latency)
+            text = piece if i == len(self._pieces) - 1 else piece + " "
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))], usage=None)
+        yield SimpleNamespace(choices=[], usage=self._usage)
+
+    async def close(self):
+        pass
+
+
+class FakeCompletions:
+    def __init__(self, client):
+        self._client = client
+
+    async def create(self, messages, stream=False, response_format=None, **kwargs):
+        client = self._client
+        client.calls += 1
+        kind = "extraction" if response_format is not None else "narrative"
+        recorded = next(client.responses[kind])
+        usage = SimpleNamespace(**recorded["usage"])
+        latency = client.latency
+        if client.count_tokens is not None:
+            # Report the size of the prompt actually sent, and make the call slower the longer it is
+            usage.prompt_tokens = client.count_tokens(messages)
+            latency += usage.prompt_tokens * client.prompt_token_latency
+        if stream:
+            await asyncio.sleep(latency)
+            return FakeStream(recorded["content"], usage, client.token_latency)
+        await asyncio.sleep(latency)
+        message = SimpleNamespace(content=recorded["content"], role="assistant")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")], usage=usage)
+
+
+class FakeAsyncOpenAI:
+    """
+    In-process stand-in for AsyncOpenAI serving recorded responses with a configurable latency.
+    Install it with llm_client.set_client(FakeAsyncOpenAI(...)).
+
+    recorded_responses: {"extraction": [...], "narrative": [...]}, each entry {"content": str, "usage": {...}};
+    calls with a response_format get the extraction responses, the others the narrative ones (round-robin).
+    With count_tokens (e.g. prompts.count_message_tokens), the usage reports the tokens of the messages sent
+    and each call takes prompt_token_latency longer per prompt token.
+    """
+
+    def __init__(self, recorded_responses, latency=0.5, token_latency=0.0, prompt_token_latency=0.0, count_tokens=None):
+        self.responses = {kind: itertools.cycle(entries) for kind, entries in recorded_responses.items()}
+        self.latency = latency
+        self.token_latency = token_latency
+        self.prompt_token_latency = prompt_token_latency
+        self.count_tokens = count_tokens
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=FakeCompletions(self))
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        with open(path) as f:
+            return cls(json.load(f), **kwargs)
@@ -0,0 +1,38 @@
+import os
+import sys
+import json
+
+import pytest
+
+# The api modules import each other as top-level modules, as on Vercel
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+FIXTURES_DIR = os.path.join(ROOT_DIR, "benchmarks", "fixtures")
+sys.path.insert(0, os.path.join(ROOT_DIR, "api"))
+# FakeAsyncOpenAI and the recorded LLM responses of the benchmarks
+sys.path.insert(0, os.path.join(ROOT_DIR, "benchmarks"))
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+# Keep the tests offline: no embedding model download
+os.environ.setdefault("SEMANTIC_LABEL_MATCHING", "0")
+
+
+@pytest.fixture
+def fake_llm():
+    """The recorded LLM responses of the benchmarks instead of OpenAI, and an empty result cache."""
+    import app
+    import llm_client
+    from cache import LRUCache, ResultCache
+    from fake_openai import FakeAsyncOpenAI
+    fake = FakeAsyncOpenAI.from_file(os.path.join(FIXTURES_DIR, "llm_responses.json"), latency=0)
+    llm_client.set_client(fake)
+    result_cache, app.result_cache = app.result_cache, ResultCache(LRUCache())
+    yield fake
+    app.result_cache = result_cache
+    llm_client.set_client(None)
+
+
+@pytest.fixture
+def products():
+    """The product documents of the benchmarks."""
+    with open(os.path.join(FIXTURES_DIR, "products.json")) as f:
+        return json.load(f)
@@ -0,0 +1,47 @@
+import copy
+import asyncio
+
+import app
+
+
+def run_batch(products, **kwargs):
+    async def collect():
+        return [item async for item in app.nutrient_analysis_batch(products, **kwargs)]
+    return sorted(asyncio.run(collect()), key=lambda item: item['index'])
+
+
+def with_energy(product, value):
+    product = copy.deepcopy(product)
+    product['_id'] = f"{product['_id']}-energy"
+    for item in product['nutritionalInformation']:
+        if item['name'] == 'Energy':
+            item['values'][0]['value'] = value
+    return product
+
+
+def test_malformed_product_fails_alone(fake_llm, products):
+    good, bad = products[0], with_energy(products[0], 'N/A')
+    results = run_batch([good, bad])
+    assert [item['index'] for item in results] == [0, 1]
+    assert 'result' in results[0] and 'error' not in results[0]
+    assert results[1]['_id'] == bad['_id']
+    assert results[1]['error'] == "non-numeric energy: 'N/A'"
+
+
+def test_batch_matches_single_product_analysis(fake_llm, products):
+    expected = [asyncio.run(app.prepare_nutrient_analysis(product)) for product in products]
+    scored = app.score_products(products)
+    for (nutrient_analysis, nutrient_analysis_rda), (analysis, analysis_rda, _) in zip(expected, scored):
+        assert analysis == nutrient_analysis
+        if analysis_rda is not None:
+            assert analysis_rda == nutrient_analysis_rda
+
+
+def test_score_documents_errors(products):
+    no_serving_unit = copy.deepcopy(products[0])
+    no_serving_unit['servingSize']['unit'] = 'pcs'
+    scores = app.score_documents([products[0], with_energy(products[0], 'N/A'), no_serving_unit, {'_id': 'x'}])
+    assert scores[0]['error'] is None and scores[0]['analysis'] is not None
+    assert isinstance(scores[1]['error'], ValueError) and scores[1]['analysis'] is None
+    assert scores[2]['error'] is None and scores[2]['analysis'] is None
+    assert isinstance(scores[3]['error'], KeyError)
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+import app
+import label_matcher
+
+
+@pytest.fixture
+def labels_resolved(monkeypatch):
+    """Set resolve_labels' answer: False as when the semantic matcher is still loading or unavailable."""
+    answer = {'resolved': True}
+
+    async def resolve_labels(nutritional_information):
+        return answer['resolved']
+
+    monkeypatch.setattr(app, "resolve_labels", resolve_labels)
+    return answer
+
+
+def cached(cache_key):
+    return asyncio.run(app.result_cache.get(cache_key))
+
+
+@pytest.mark.parametrize("resolved", [True, False])
+def test_narrative_is_cached_only_with_resolved_labels(fake_llm, products, labels_resolved, resolved):
+    labels_resolved['resolved'] = resolved
+    product = products[0]
+    narrative = asyncio.run(app.run_nutrient_analysis(product))
+    assert narrative
+    assert (cached(app.analysis_cache_key(product)) == narrative) is resolved
+    extraction = cached(app.extraction_cache_key(product['nutritionalInformation'], product['servingSize']['quantity']))
+    assert (extraction is not None) is resolved
+
+
+@pytest.mark.parametrize("resolved", [True, False])
+def test_stream_is_cached_only_with_resolved_labels(fake_llm, products, labels_resolved, resolved):
+    labels_resolved['resolved'] = resolved
+    product = products[1]
+
+    async def stream():
+        return [event async for event in app.stream_nutrient_analysis(product)]
+
+    events = asyncio.run(stream())
+    assert events[-1].startswith("event: done")
+    assert (cached(app.analysis_cache_key(product)) is not None) is resolved
+
+
+def test_precomputed_only_with_resolved_labels(fake_llm, products, labels_resolved):
+    labels_resolved['resolved'] = False
+    assert asyncio.run(app.compute_precomputed(products[2])) is None
+    labels_resolved['resolved'] = True
+    precomputed = asyncio.run(app.compute_precomputed(products[2]))
+    assert precomputed['sourceHash'] == app.precompute_source_hash(products[2])
+    assert precomputed['analysis'] is not None
+
+
+def test_batch_results_are_cached_only_with_resolved_labels(fake_llm, products, labels_resolved):
+    labels_resolved['resolved'] = False
+
+    async def batch():
+        return [item async for item in app.nutrient_analysis_batch(products)]
+
+    assert all('result' in item for item in asyncio.run(batch()))
+    assert all(cached(app.analysis_cache_key(product)) is None for product in products)
+
+
+def test_matches_are_least_recently_used(monkeypatch):
+    monkeypatch.setattr(label_matcher, "LABEL_MATCH_CACHE_SIZE", 2)
+    monkeypatch.setattr(label_matcher, "_matches", type(label_matcher._matches)())
+    label_matcher.remember_match("na", ("sodium", 0.9))
+    label_matcher.remember_match("lipids", ("totalFat", 0.8))
+    assert label_matcher.cached_match("na") == ("sodium", 0.9)
+    label_matcher.remember_match("kcals", ("energy", 0.85))
+    # "lipids" was used least recently
+    assert label_matcher.cached_match("lipids") is None
+    assert label_matcher.cached_match("na") == ("sodium", 0.9)
+    assert label_matcher.cached_match("kcals") == ("energy", 0.85)
@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+from openai import APIConnectionError
+
+import llm_client
+from fake_openai import FakeAsyncOpenAI
+
+messages = [{"role": "user", "content": "Calories exceed the ICMR-defined threshold by 84.8%."}]
+
+
+class FailingFirst(FakeAsyncOpenAI):
+    """Fails the first `failures` calls with a retryable error, then serves the recorded responses."""
+
+    def __init__(self, failures, **kwargs):
+        super().__init__({"extraction": [{"content": "{}", "usage": {}}],
+                          "narrative": [{"content": "Calories are high. Sugar is high.", "usage": {}}]}, **kwargs)
+        self.failures = failures
+        create = self.chat.completions.create
+
+        async def create_or_fail(**kwargs):
+            if self.failures:
+                self.failures -= 1
+                raise APIConnectionError(request=None)
+            return await create(**kwargs)
+
+        self.chat.completions.create = create_or_fail
+
+
+@pytest.fixture(autouse=True)
+def one_slot(monkeypatch):
+    monkeypatch.setattr(llm_client, "_concurrency_limit", asyncio.Semaphore(1))
+    monkeypatch.setattr(llm_client, "LLM_BACKOFF_BASE", 0.2)
+    monkeypatch.setattr(llm_client, "LLM_BACKOFF_MAX", 0.2)
+    yield
+    llm_client.set_client(None)
+
+
+def test_create_chat_completion_retries_without_holding_the_slot():
+    llm_client.set_client(FailingFirst(failures=1, latency=0.01))
+
+    async def main():
+        finished = []
+
+        async def analyse(name):
+            await llm_client.create_chat_completion(call=name, model="gpt-4o", messages=messages)
+            finished.append(name)
+
+        retried = asyncio.ensure_future(analyse("retried"))
+        await asyncio.sleep(0.05)
+        # The only slot is free while the first call backs off
+        await analyse("other")
+        await retried
+        return finished
+
+    assert asyncio.run(main()) == ["other", "retried"]
+
+
+def test_stream_retries_without_holding_the_slot():
+    client = FailingFirst(failures=2, latency=0.01)
+    llm_client.set_client(client)
+
+    async def main():
+        async def stream():
+            return [text async for text in llm_client.stream_chat_completion(call="stream", model="gpt-4o", messages=messages)]
+
+        streamed = asyncio.ensure_future(stream())
+        await asyncio.sleep(0.05)
+        assert not llm_client._concurrency_limit.locked()
+        return await streamed
+
+    assert "".join(asyncio.run(main())) == "Calories are high. Sugar is high."
+    assert client.failures == 0
+
+
+def test_stream_releases_the_slot_before_a_slow_consumer_is_done():
+    llm_client.set_client(FailingFirst(failures=0, latency=0.01))
+
+    async def main():
+        texts = []
+        async for text in llm_client.stream_chat_completion(call="stream", model="gpt-4o", messages=messages):
+            texts.append(text)
+            # A slow client: the whole narrative has been generated before it reads the second piece
+            await asyncio.sleep(0.05)
+            if len(texts) == 2:
+                assert not llm_client._concurrency_limit.locked()
+        return texts
+
+    assert "".join(asyncio.run(main())) == "Calories are high. Sugar is high."
+
+
+def test_stream_closed_early_aborts_the_generation():
+    llm_client.set_client(FakeAsyncOpenAI({"extraction": [], "narrative": [{"content": " ".join(["token"] * 100), "usage": {}}]},
+                                          latency=0, token_latency=0.01))
+
+    async def main():
+        stream = llm_client.stream_chat_completion(call="stream", model="gpt-4o", messages=messages)
+        async for _ in stream:
+            break
+        await stream.aclose()
+        await asyncio.sleep(0.05)
+        return llm_client._concurrency_limit.locked()
+
+    assert asyncio.run(main()) is False
+
+
+def test_stream_generation_is_bounded(monkeypatch):
+    monkeypatch.setattr(llm_client, "LLM_STREAM_TIMEOUT", 0.05)
+    llm_client.set_client(FakeAsyncOpenAI({"extraction": [], "narrative": [{"content": " ".join(["token"] * 100), "usage": {}}]},
+                                          latency=0, token_latency=0.01))
+
+    async def main():
+        async for _ in llm_client.stream_chat_completion(call="stream", model="gpt-4o", messages=messages):
+            pass
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(main())
+    assert not llm_client._concurrency_limit.locked()
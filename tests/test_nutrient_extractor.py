@@ -0,0 +1,156 @@
+import pytest
+
+from nutrient_extractor import match_nutrient, extract_nutrition_per_serving, nutrient_name_list
+
+# Label of Parle-G Gold Biscuits (see find_product_nutrients in app.py), serving size 18.8 g
+parle_g_label = [
+    {'name': 'Energy', 'unit': 'kcal', 'values': [{'base': 'per 100 g', 'value': 462}]},
+    {'name': 'Protein', 'unit': 'g', 'values': [{'base': 'per 100 g', 'value': 6.7}]},
+    {'name': 'Carbohydrate', 'unit': 'g', 'values': [{'base': 'per 100 g', 'value': 76.0}, {'base': 'of which sugars', 'value': 26.9}]},
+    {'name': 'Fat', 'unit': 'g', 'values': [{'base': 'per 100 g', 'value': 14.6}, {'base': 'Saturated Fat', 'value': 6.8}, {'base': 'Trans Fat', 'value': 0}]},
+    {'name': 'Total Sugars', 'unit': 'g', 'values': [{'base': 'per 100 g', 'value': 27.7}]},
+    {'name': 'Added Sugars', 'unit': 'g', 'values': [{'base': 'per 100 g', 'value': 26.9}]},
+    {'name': 'Cholesterol', 'unit': 'mg', 'values': [{'base': 'per 100 g', 'value': 0}]},
+    {'name': 'Sodium', 'unit': 'mg', 'values': [{'base': 'per 100 g', 'value': 281}]},
+]
+
+
+def label(*entries, base='per 100 g'):
+    """Label entries from (name, unit, value) tuples, all on the same basis."""
+    return [{'name': name, 'unit': unit, 'values': [{'base': base, 'value': value}]} for name, unit, value in entries]
+
+
+@pytest.mark.parametrize("name, key", [
+    ('Energy', 'energy'),
+    ('Calories', 'energy'),
+    ('Energy (kcal)', 'energy'),
+    ('Protein', 'protein'),
+    ('Total Carbohydrate', 'carbohydrates'),
+    ('Carbs', 'carbohydrates'),
+    ('Added Sugars', 'addedSugars'),
+    ('Dietary Fibre', 'dietaryFiber'),
+    ('Total Fat', 'totalFat'),
+    ('Fats', 'totalFat'),
+    ('Lipids (total)', 'totalFat'),
+    ('Saturated Fat', 'saturatedFat'),
+    ('Saturated Fatty Acids', 'saturatedFat'),
+    ('of which saturates', 'saturatedFat'),
+    ('Mono-unsaturated Fat', 'monounsaturatedFat'),
+    ('PUFA', 'polyunsaturatedFat'),
+    ('Trans Fatty Acids', 'transFat'),
+    ('Sodium (Na)', 'sodium'),
+    ('Na', 'sodium'),
+    ('Salt', 'salt'),
+])
+def test_match_nutrient_synonyms(name, key):
+    assert match_nutrient(name) == key
+
+
+@pytest.mark.parametrize("name", [
+    'Unsaturated Fat',
+    'Total Unsaturated Fatty Acids',
+    'Calories from Fat',
+    'Energy from Fat',
+    'Energy from Saturated Fat',
+    'Total Sugars',
+    'Cholesterol',
+    'Fatty acids',
+    'Natural flavours',
+    '',
+])
+def test_match_nutrient_unknown_labels(name):
+    assert match_nutrient(name) is None
+
+
+def test_parle_g_label():
+    nutrition_data, unresolved = extract_nutrition_per_serving(parle_g_label, 18.8)
+    assert unresolved == []
+    assert nutrition_data == {
+        'energy': 462, 'protein': 6.7, 'carbohydrates': 76.0, 'addedSugars': 26.9, 'dietaryFiber': 0,
+        'totalFat': 14.6, 'saturatedFat': 6.8, 'monounsaturatedFat': 0, 'polyunsaturatedFat': 0,
+        'transFat': 0, 'sodium': 281, 'servingSize': 100.0,
+    }
+
+
+def test_kilojoules_and_salt():
+    nutrition_data, _ = extract_nutrition_per_serving(
+        label(('Energy', 'kJ', 1933), ('Protein', 'g', 6.7), ('Carbohydrate', 'g', 76), ('Fat', 'g', 14.6), ('Salt', 'g', 0.7)),
+        18.8)
+    assert nutrition_data['energy'] == pytest.approx(1933 / 4.184, abs=1e-3)
+    # 1 g of salt is 400 mg of sodium
+    assert nutrition_data['sodium'] == pytest.approx(280)
+
+
+def test_sodium_wins_over_salt():
+    nutrition_data, _ = extract_nutrition_per_serving(
+        label(('Energy', 'kcal', 462), ('Protein', 'g', 6.7), ('Carbohydrate', 'g', 76), ('Fat', 'g', 14.6),
+              ('Salt', 'g', 0.7), ('Sodium', 'mg', 281)),
+        18.8)
+    assert nutrition_data['sodium'] == 281
+
+
+def test_per_serving_basis():
+    nutrition_data, _ = extract_nutrition_per_serving(
+        label(('Energy', 'kcal', 87), ('Protein', 'g', 1.3), ('Carbohydrate', 'g', 14.3), ('Fat', 'g', 2.7), ('Sodium', 'mg', 53),
+              base='per serving'),
+        18.8)
+    assert nutrition_data['servingSize'] == 18.8
+    assert nutrition_data['energy'] == 87
+
+
+def test_mixed_bases_are_normalized():
+    nutritional_information = label(('Energy', 'kcal', 462), ('Protein', 'g', 6.7), ('Carbohydrate', 'g', 76), ('Fat', 'g', 14.6))
+    nutritional_information.append({'name': 'Sodium', 'unit': 'mg', 'values': [{'base': 'per 50 g', 'value': 140.5}]})
+    nutrition_data, _ = extract_nutrition_per_serving(nutritional_information, 18.8)
+    assert nutrition_data['servingSize'] == 100.0
+    assert nutrition_data['sodium'] == pytest.approx(281)
+
+
+def test_energy_from_atwater_factors():
+    nutrition_data, _ = extract_nutrition_per_serving(
+        label(('Protein', 'g', 10), ('Carbohydrate', 'g', 50), ('Fat', 'g', 20), ('Sodium', 'mg', 100)), 30)
+    assert nutrition_data['energy'] == 4 * 10 + 4 * 50 + 9 * 20
+
+
+def test_unsaturated_fat_is_not_saturated_fat():
+    nutrition_data, _ = extract_nutrition_per_serving(
+        label(('Energy', 'kcal', 500), ('Protein', 'g', 8), ('Carbohydrate', 'g', 60), ('Total Fat', 'g', 25),
+              ('Unsaturated Fat', 'g', 12), ('Saturated Fat', 'g', 8), ('Sodium', 'mg', 300)),
+        30)
+    assert nutrition_data['saturatedFat'] == 8
+    assert nutrition_data['totalFat'] == 25
+
+
+def test_calories_from_fat_is_not_energy():
+    nutrition_data, _ = extract_nutrition_per_serving(
+        label(('Calories from Fat', 'kcal', 225), ('Energy', 'kcal', 500), ('Protein', 'g', 8), ('Carbohydrate', 'g', 60),
+              ('Total Fat', 'g', 25), ('Sodium', 'mg', 300)),
+        30)
+    assert nutrition_data['energy'] == 500
+
+
+def test_unrecognised_label_is_left_to_the_llm():
+    # Without a recognisable fat entry the rules don't guess, the label goes to the LLM extraction
+    nutrition_data, unresolved = extract_nutrition_per_serving(
+        label(('Energy', 'kcal', 500), ('Protein', 'g', 8), ('Carbohydrate', 'g', 60), ('Unsaturated Fat', 'g', 12),
+              ('Sodium', 'mg', 300)),
+        30)
+    assert nutrition_data is None
+    assert unresolved == ["missing totalFat"]
+
+
+@pytest.mark.parametrize("nutritional_information, reason", [
+    (label(('Energy', 'kcal', 'N/A'), ('Protein', 'g', 8), ('Carbohydrate', 'g', 60), ('Fat', 'g', 25), ('Sodium', 'mg', 300)),
+     "non-numeric value for Energy"),
+    (label(('Energy', 'kcal', 500), ('Protein', 'oz', 8), ('Carbohydrate', 'g', 60), ('Fat', 'g', 25), ('Sodium', 'mg', 300)),
+     "unknown unit 'oz' for Protein"),
+])
+def test_unresolved_labels(nutritional_information, reason):
+    nutrition_data, unresolved = extract_nutrition_per_serving(nutritional_information, 30)
+    assert nutrition_data is None
+    assert reason in unresolved
+
+
+def test_all_nutrients_are_returned():
+    nutrition_data, _ = extract_nutrition_per_serving(parle_g_label, 18.8)
+    assert list(nutrition_data) == nutrient_name_list + ['servingSize']
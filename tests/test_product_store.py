@@ -0,0 +1,152 @@
+"""
+product_store against an in-memory mongomock collection (pip install mongomock).
+
+    python -m pytest tests
+"""
+import json
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+from bson import ObjectId
+
+import product_store
+
+
+class RecordingCollection:
+    """Forwards to a mongomock collection and records the filters of find()."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.find_filters = []
+
+    def find(self, filter=None, *args, **kwargs):
+        self.find_filters.append(filter)
+        return self.collection.find(filter, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+
+def product_document(_id, **fields):
+    document = {
+        '_id': _id,
+        'productName': f"Product {_id}",
+        'brandName': "Parle",
+        'servingSize': {'quantity': 18.8, 'unit': 'g'},
+        'nutritionalInformation': [{'name': 'Energy', 'unit': 'kcal', 'values': [{'base': 'per 100 g', 'value': 462}]}],
+        'ingredients': [{'name': 'Sugar', 'percent': '', 'metadata': ''}],
+        'claims': ['This product does not contain gold'],
+        # Not read by the pipeline, must not be returned
+        'fssaiLicenseNumbers': [10013022002253],
+        'shelfLife': '7 months from packaging',
+    }
+    document.update(fields)
+    return document
+
+
+@pytest.fixture
+def collection():
+    collection = RecordingCollection(mongomock.MongoClient().db.products)
+    product_store.set_collection(collection)
+    yield collection
+    product_store.set_collection(None)
+
+
+@pytest.fixture
+def object_ids(collection):
+    ids = [ObjectId() for _ in range(5)]
+    collection.insert_many([product_document(_id) for _id in ids])
+    return ids
+
+
+def test_find_product_by_object_id(collection, object_ids):
+    product = product_store.find_product(str(object_ids[2]))
+    assert product['_id'] == object_ids[2]
+    assert product['productName'] == f"Product {object_ids[2]}"
+
+
+def test_find_product_by_string_id(collection):
+    collection.insert_one(product_document("import-42"))
+    assert product_store.find_product("import-42")['_id'] == "import-42"
+    assert product_store.find_product("import-43") is None
+
+
+def test_find_product_projection(collection, object_ids):
+    product = product_store.find_product(str(object_ids[0]))
+    assert set(product) == {'_id', 'productName', 'brandName', 'servingSize', 'nutritionalInformation', 'ingredients', 'claims'}
+    assert product['ingredients'] == [{'name': 'Sugar'}]
+
+
+def test_find_product_projection_includes_precomputed_analysis(collection):
+    collection.insert_one(product_document("p1", **{product_store.PRECOMPUTED_FIELD: {'sourceHash': 'x'}}))
+    assert product_store.find_product("p1")[product_store.PRECOMPUTED_FIELD] == {'sourceHash': 'x'}
+
+
+def test_find_products_keeps_order_and_returns_none_for_unknown_ids(collection, object_ids):
+    unknown = str(ObjectId())
+    requested = [str(object_ids[3]), unknown, str(object_ids[0]), "not-an-object-id"]
+    products = product_store.find_products(requested)
+    assert [product and product['_id'] for product in products] == [object_ids[3], None, object_ids[0], None]
+
+
+def test_find_products_duplicate_ids(collection, object_ids):
+    requested = [str(object_ids[1]), str(object_ids[1]), str(object_ids[4]), str(object_ids[1])]
+    products = product_store.find_products(requested)
+    assert [product['_id'] for product in products] == [object_ids[1], object_ids[1], object_ids[4], object_ids[1]]
+    # Each id is queried once
+    assert sum(len(filter['_id']['$in']) for filter in collection.find_filters) == 2
+
+
+def test_find_products_mixed_id_types(collection, object_ids):
+    collection.insert_one(product_document("import-1"))
+    products = product_store.find_products(["import-1", str(object_ids[0])])
+    assert [product['_id'] for product in products] == ["import-1", object_ids[0]]
+
+
+def test_find_products_chunks_in_queries(collection, object_ids, monkeypatch):
+    monkeypatch.setattr(product_store, "MONGODB_IN_BATCH_SIZE", 2)
+    requested = [str(_id) for _id in reversed(object_ids)] + [str(ObjectId())]
+    products = product_store.find_products(requested)
+    assert [len(filter['_id']['$in']) for filter in collection.find_filters] == [2, 2, 2]
+    assert [product and product['_id'] for product in products] == list(reversed(object_ids)) + [None]
+
+
+def test_find_products_projection(collection, object_ids):
+    for product in product_store.find_products([str(_id) for _id in object_ids]):
+        assert 'fssaiLicenseNumbers' not in product and 'shelfLife' not in product
+
+
+def test_find_products_empty(collection):
+    assert product_store.find_products([]) == []
+    assert collection.find_filters == []
+
+
+@pytest.fixture
+def client(collection):
+    from fastapi.testclient import TestClient
+    import app
+    return TestClient(app.app)
+
+
+def test_nutrient_analysis_unknown_product_id(client):
+    response = client.get("/api/nutrient-analysis", params={'product_id': str(ObjectId())})
+    assert response.status_code == 404
+    assert "not found" in response.json()['detail']
+
+
+def test_nutrient_analysis_product_ids_not_found(client):
+    unknown = [str(ObjectId()), "import-404"]
+    response = client.get("/api/nutrient-analysis", params={'product_ids': unknown})
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith("application/x-ndjson")
+    lines = sorted((json.loads(line) for line in response.text.splitlines()), key=lambda item: item['index'])
+    assert lines == [
+        {'index': 0, '_id': unknown[0], 'error': "product not found"},
+        {'index': 1, '_id': unknown[1], 'error': "product not found"},
+    ]
+
+
+def test_nutrient_analysis_profiles_unknown_product_id(client):
+    response = client.get("/api/nutrient-analysis/profiles", params={'product_id': str(ObjectId())})
+    assert response.status_code == 404
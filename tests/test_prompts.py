@@ -0,0 +1,40 @@
+import json
+import asyncio
+
+import app
+from nutrient_extractor import ignored_labels, unused_labels
+from prompts import compact_label, icmr_payload
+
+
+def test_icmr_payload_is_built_from_the_numbers():
+    # The text is for people; the payload doesn't depend on its wording
+    nutrient_analysis = {'analysis': "Calories are high.", 'percentageDiffs': {'calories': 84.79999999999997, 'salt': -55.04}}
+    nutrient_analysis_rda = {'rda': "Nutrition per serving ...", 'percentages': {'energy': 3.89, 'protein': 12.0}}
+    assert json.loads(icmr_payload(nutrient_analysis, nutrient_analysis_rda)) == {
+        'thresholds': {'calories': 84.8, 'salt': -55}, 'rda': {'energy': 3.9, 'protein': 12}}
+
+
+def test_icmr_payload_passes_rda_errors_on():
+    nutrient_analysis = {'analysis': 'N/A', 'percentageDiffs': {}}
+    error = json.dumps({"error": "Invalid user serving size"})
+    assert json.loads(icmr_payload(nutrient_analysis, {'rda': error, 'percentages': None})) == {'thresholds': {}, 'rda': error}
+    assert json.loads(icmr_payload(nutrient_analysis, {'rda': "", 'percentages': None})) == {'thresholds': {}}
+
+
+def test_prepared_analysis_carries_the_numbers(fake_llm, products):
+    nutrient_analysis, nutrient_analysis_rda = asyncio.run(app.prepare_nutrient_analysis(products[0]))
+    assert set(nutrient_analysis['percentageDiffs']) == {'calories', 'sugar', 'salt'}
+    assert nutrient_analysis_rda['rda'].startswith("Nutrition per serving as percentage")
+    assert all(isinstance(value, float) for value in nutrient_analysis_rda['percentages'].values())
+    payload = json.loads(app.icmr_messages(nutrient_analysis, nutrient_analysis_rda)[-1]['content'])
+    assert set(payload['rda']) == set(nutrient_analysis_rda['percentages'])
+
+
+def test_unused_labels_are_left_out_of_the_extraction_prompt():
+    assert set(unused_labels) <= set(ignored_labels)
+    label = [{'name': 'Energy', 'unit': 'kcal', 'values': [{'base': 'per 100 g', 'value': 462}]},
+             {'name': 'Total Sugars', 'unit': 'g', 'values': [{'base': 'per 100 g', 'value': 26.9}]},
+             {'name': 'Cholesterol', 'unit': 'mg', 'values': [{'base': 'per 100 g', 'value': 0}]},
+             {'name': 'Vitamin B1', 'unit': 'mg', 'values': [{'base': 'per 100 g', 'value': 0.1}]}]
+    # Sugars are ignored by the rules but the extraction needs them
+    assert compact_label(label) == "Energy (kcal): per 100 g: 462\nTotal Sugars (g): per 100 g: 26.9"
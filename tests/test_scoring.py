@@ -0,0 +1,94 @@
+"""
+The single-product wrappers take the scalar paths of scoring.py (*_scalar) where they can; they must
+give exactly the results of the array paths used for bulk scoring.
+"""
+import math
+import random
+import asyncio
+
+import numpy as np
+import pytest
+
+from nutrient_analyzer import analyze_nutrients, analyze_nutrients_bulk
+from nutrient_extractor import nutrient_name_list
+from profiles import profile_index, daily_value_rows, threshold_rows
+from rda import process_nutrition_data, process_nutrition_data_bulk
+
+random_inputs = 5000
+
+
+def same(a, b):
+    """Equal, with NaN equal to NaN and the types of numbers compared too."""
+    if isinstance(a, dict):
+        return isinstance(b, dict) and a.keys() == b.keys() and all(same(a[key], b[key]) for key in a)
+    if isinstance(a, (list, tuple)):
+        return isinstance(b, (list, tuple)) and len(a) == len(b) and all(same(x, y) for x, y in zip(a, b))
+    if isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b):
+        return True
+    return a == b and type(a) == type(b)
+
+
+def random_number(rng):
+    # Integers and floats, values close to rounding ties, zero, NaN and infinity
+    return rng.choice([0, 0.0, 1, rng.randint(0, 5000), rng.uniform(0, 1000), round(rng.uniform(0, 100), 2),
+                       rng.uniform(0, 1e-3), 1e6 * rng.random(), 0.005, 2.675, 1.005, math.nan, math.inf])
+
+
+@pytest.fixture
+def rng():
+    return random.Random(7)
+
+
+def test_analyze_nutrients_matches_bulk(rng):
+    profile_ids = [None] + list(profile_index)
+    for _ in range(random_inputs):
+        product_type = rng.choice(['solid', 'liquid'])
+        calories, sugar, salt = [rng.choice([None, random_number(rng)]) for _ in range(3)]
+        serving_size = rng.choice([0, 0.0, -5, math.nan, 1, 18.8, 250, rng.uniform(0.1, 500), rng.randint(1, 1000)])
+        profile_id = rng.choice(profile_ids)
+        rows = None if profile_id is None else threshold_rows([profile_id], [product_type])
+        single = asyncio.run(analyze_nutrients(product_type, calories, sugar, salt, serving_size, rows))
+        with np.errstate(all='ignore'):
+            bulk = analyze_nutrients_bulk([product_type], [calories], [sugar], [salt], [serving_size], rows)[0]
+        assert same(single, bulk), (product_type, calories, sugar, salt, serving_size, profile_id)
+
+
+def test_process_nutrition_data_matches_bulk(rng):
+    profile_ids = [None] + list(profile_index)
+    for _ in range(random_inputs):
+        nutrition_per_serving = {key: random_number(rng) for key in nutrient_name_list}
+        nutrition_per_serving['servingSize'] = rng.choice([0, 100, 100.0, 18.8, rng.uniform(1, 300), rng.randint(1, 500)])
+        user_serving_size = rng.choice([1, 18.8, 250.0, rng.uniform(0.1, 500), rng.randint(1, 400)])
+        profile_id = rng.choice(profile_ids)
+        daily_value_row = None if profile_id is None else daily_value_rows([profile_id])[0]
+        single = process_nutrition_data(nutrition_per_serving, user_serving_size, daily_value_row)
+        with np.errstate(all='ignore'):
+            bulk = process_nutrition_data_bulk([nutrition_per_serving], [user_serving_size], daily_value_row)[0]
+        assert same(single, bulk), (nutrition_per_serving, user_serving_size, profile_id)
+
+
+@pytest.mark.parametrize("serving_size", [0, 0.0, -1, math.nan])
+def test_analyze_nutrients_invalid_serving_size(serving_size):
+    invalid = {'analysis': 'N/A', 'percentageDiffs': {}}
+    assert asyncio.run(analyze_nutrients('solid', 462, 26.9, 0.7, serving_size)) == invalid
+    assert analyze_nutrients_bulk(['solid'], [0], [0], [0], [serving_size]) == [invalid]
+
+
+def test_analyze_nutrients():
+    # The formula and wording of the original per-product implementation
+    calories, sugar, salt, serving_size = 86.856, 5.0572, 52.828, 18.8
+    percentage_diffs = [(value / serving_size * 100 - threshold) / threshold * 100
+                        for value, threshold in ((calories, 250), (sugar, 3), (salt, 625))]
+    expected = (f"Calories exceed the ICMR-defined threshold by {percentage_diffs[0]}%."
+                f" Sugar exceeds the ICMR-defined threshold by {percentage_diffs[1]}%."
+                f"Salt is {abs(percentage_diffs[2])}% below the ICMR-defined threshold.")
+    assert asyncio.run(analyze_nutrients('solid', calories, sugar, salt, serving_size)) == {
+        'analysis': expected, 'percentageDiffs': dict(zip(['calories', 'sugar', 'salt'], percentage_diffs))}
+
+
+def test_process_nutrition_data_zero_label_serving_size():
+    nutrition_per_serving = dict.fromkeys(nutrient_name_list, 10)
+    nutrition_per_serving['servingSize'] = 0
+    scaled_nutrition, percentage_daily_values = process_nutrition_data(nutrition_per_serving, 18.8)
+    assert all(math.isnan(value) for value in scaled_nutrition.values())
+    assert set(percentage_daily_values.values()) == {'N/A'}
@@ -0,0 +1,78 @@
+import io
+import csv
+import copy
+import importlib.util
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+import product_store
+from spreadsheets import score_chunk, iter_scored_rows, iter_csv, label_row_to_product, output_columns
+
+
+def with_energy(product, value):
+    product = copy.deepcopy(product)
+    product['_id'] = f"{product['_id']}-energy"
+    for item in product['nutritionalInformation']:
+        if item['name'] == 'Energy':
+            item['values'][0]['value'] = value
+    return product
+
+
+@pytest.fixture
+def client():
+    return TestClient(app.app)
+
+
+def test_malformed_product_fails_its_row_only(products):
+    good, bad = products[0], with_energy(products[0], 'N/A')
+    rows = score_chunk([good, bad])
+    assert rows[0]['error'] is None
+    assert rows[0]['analysis'].startswith("Calories exceed")
+    assert rows[0]['energy (% RDA)'] > 0
+    assert rows[1]['id'] == bad['_id']
+    assert rows[1]['error'] == "invalid product: non-numeric energy: 'N/A'"
+    assert rows[1]['analysis'] is None and rows[1]['energy (% RDA)'] is None
+
+
+def test_csv_export_of_a_malformed_product(products):
+    good, bad = products[0], with_energy(products[0], 'N/A')
+    text = "".join(iter_csv(iter_scored_rows([good, bad, products[1]], chunk_size=2)))
+    rows = list(csv.DictReader(io.StringIO(text)))
+    assert [row['id'] for row in rows] == [good['_id'], bad['_id'], products[1]['_id']]
+    assert [bool(row['error']) for row in rows] == [False, True, False]
+
+
+def test_export_endpoint_streams_past_a_malformed_product(client, products):
+    mongomock = pytest.importorskip("mongomock")
+    collection = mongomock.MongoClient().db.products
+    collection.insert_many([copy.deepcopy(products[0]), with_energy(products[0], 'N/A'), copy.deepcopy(products[1])])
+    product_store.set_collection(collection)
+    try:
+        response = client.get("/api/nutrient-analysis/export", params={'format': 'csv'})
+    finally:
+        product_store.set_collection(None)
+    assert response.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(rows) == 3
+    assert [row['error'] for row in rows].count("invalid product: non-numeric energy: 'N/A'") == 1
+
+
+def test_label_rows():
+    row = {'id': 'p1', 'productName': 'Biscuits', 'servingSize': '18.8', 'servingUnit': 'g',
+           'Energy (kcal)': '462', 'Protein (g)': '6.7', 'Carbohydrate (g)': '76', 'Fat (g)': '14.6', 'Sodium (mg)': '281'}
+    scored = score_chunk([row, dict(row, id='p2', **{'Energy (kcal)': 'N/A'})], label_row_to_product)
+    assert scored[0]['error'] is None and scored[0]['energy (per serving)'] == pytest.approx(86.86)
+    assert scored[1]['error'] == "invalid product: Energy (kcal): not a number: 'N/A'"
+    assert list(scored[0]) == output_columns
+
+
+def test_xlsx_without_openpyxl(client, monkeypatch):
+    # The serverless function is deployed without openpyxl (requirements-worker.txt)
+    find_spec = importlib.util.find_spec
+    monkeypatch.setattr(importlib.util, "find_spec", lambda name, *args: None if name == "openpyxl" else find_spec(name, *args))
+    response = client.get("/api/nutrient-analysis/export", params={'format': 'xlsx'})
+    assert response.status_code == 501
+    response = client.post("/api/nutrient-analysis/import", params={'output_format': 'xlsx'}, content=b"id,servingSize\n")
+    assert response.status_code == 501